@@ -0,0 +1,141 @@
+import asyncio
+import logging
+from collections import deque
+import metrics
+
+logger = logging.getLogger("controller")
+
+write_behind_flushed = metrics.Counter(
+    "write_behind_flushed_total", "Items written by write-behind buffers.",
+    ("buffer",))
+write_behind_failures = metrics.Counter(
+    "write_behind_flush_failures_total", "Write-behind flushes that failed "
+    "and were retried.", ("buffer",))
+write_behind_dropped = metrics.Counter(
+    "write_behind_dropped_total", "Items given up on because they can "
+    "never be written.", ("buffer",))
+write_behind_rejected = metrics.Counter(
+    "write_behind_rejected_total", "Submissions refused because a "
+    "write-behind buffer stayed full.", ("buffer",))
+_buffers = list()
+metrics.CallbackGauge(
+    "write_behind_pending", "Items waiting in write-behind buffers.",
+    ("buffer",), lambda: {(b.name,): len(b.items) for b in _buffers})
+
+
+class BufferFull(Exception):
+    pass
+
+
+class WriteBehind:
+    # Accepts items at once and hands them to `flush(batch)` in batches of
+    # up to max_batch, whenever a batch fills up or max_delay seconds
+    # pass. `flush` returns the items it could never write, which are
+    # dropped; it is expected to sort out bad items itself. A flush that
+    # raises has already acknowledged items at stake, so its batch is put
+    # back and retried, with the wait doubling up to max_backoff seconds
+    # while failures continue. At most max_pending items are held;
+    # submit() waits up to submit_timeout for room and then raises
+    # BufferFull, so callers can shed load.
+
+    def __init__(self, name, flush, max_batch, max_delay, max_pending,
+                 submit_timeout, max_backoff=60):
+        self.name = name
+        self.flush_function = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.submit_timeout = submit_timeout
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.items = deque()
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._closing = False
+        self._task = None
+        _buffers.append(self)
+
+    async def submit(self, item):
+        if self._closing or self._task is None:
+            raise BufferFull(f"{self.name} is not accepting submissions.")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.submit_timeout
+        while len(self.items) >= self.max_pending:
+            self._space.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._space.wait(),
+                                       deadline - loop.time())
+            except asyncio.TimeoutError:
+                write_behind_rejected.inc(self.name)
+                raise BufferFull(f"Too many pending {self.name}, "
+                                 f"try again shortly.")
+        self.items.append(item)
+        if len(self.items) >= self.max_batch:
+            self._wakeup.set()
+
+    async def flush(self):
+        # Writes everything pending; False if a batch failed and was put
+        # back for the next attempt.
+        while self.items:
+            count = min(self.max_batch, len(self.items))
+            batch = [self.items.popleft() for _ in range(count)]
+            try:
+                dropped = len(await self.flush_function(batch) or [])
+            except Exception as e:
+                self.items.extendleft(reversed(batch))
+                self.failures += 1
+                write_behind_failures.inc(self.name)
+                logger.error(f"Flushing {count} {self.name} failed "
+                             f"({self.failures} in a row): {e!r}")
+                return False
+            self.failures = 0
+            if dropped:
+                write_behind_dropped.inc(self.name, amount=dropped)
+            write_behind_flushed.inc(self.name, amount=count - dropped)
+            self._space.set()
+        return True
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not await self.flush() and not self._closing:
+                # stop() cuts the wait short.
+                try:
+                    await asyncio.wait_for(self._stopping.wait(),
+                                           self.backoff())
+                except asyncio.TimeoutError:
+                    pass
+        # Shutdown: a few more attempts, then what is left is logged in
+        # full so it can be replayed.
+        for _ in range(3):
+            if await self.flush():
+                return
+            await asyncio.sleep(self.max_delay)
+        logger.error(f"{len(self.items)} {self.name} could not be written "
+                     f"before shutdown")
+        for item in self.items:
+            logger.error(f"Unwritten {self.name}: {item!r}")
+
+    def backoff(self):
+        return min(self.max_delay * 2 ** (self.failures - 1),
+                   self.max_backoff)
+
+    def start(self):
+        self._closing = False
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        self._stopping.set()
+        await self._task
+        self._task = None
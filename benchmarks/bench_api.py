@@ -0,0 +1,250 @@
+"""Throughput and latency of the key API routes, without a live MongoDB.
+
+Drives the FastAPI app in-process through httpx's ASGI transport. The
+database is an in-memory mongomock-motor stand-in by default, or a local
+MongoDB given with --mongodb; either way the benchmark uses (and first
+drops) its own "couchbench" database. Collections are seeded with the
+requested volumes, every scenario runs `--requests` calls at
+`--concurrency`, and the results are written as JSON so runs can be
+compared between commits.
+
+Run from the repository root:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_api --scale 1k --output bench_api.json
+    python -m benchmarks.bench_api --scale 100k --mongodb mongodb://localhost
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import time
+from uuid import uuid4
+import bcrypt
+import httpx
+import database as db
+import limiter
+import main
+from constants import BCRYPT_ROUNDS
+
+SCALES = {"1k": 1000, "10k": 10000, "100k": 100000}
+PASSWORD = "benchmark"
+DATABASE_NAME = "couchbench"
+SEED_BATCH = 5000
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_client(mongodb):
+    if mongodb:
+        import motor.motor_asyncio
+        return motor.motor_asyncio.AsyncIOMotorClient(
+            mongodb, **db.client_options())
+    from mongomock_motor import AsyncMongoMockClient
+    return AsyncMongoMockClient()
+
+
+async def insert_batches(collection, documents):
+    batch = list()
+    for document in documents:
+        batch.append(document)
+        if len(batch) == SEED_BATCH:
+            await collection.insert_many(batch)
+            batch = list()
+    if batch:
+        await collection.insert_many(batch)
+
+
+async def seed(mongo_client, users, events, tickets):
+    await mongo_client.drop_database(DATABASE_NAME)
+    # One hash shared by every seeded credential keeps seeding fast while
+    # logins still pay the configured bcrypt cost.
+    hashed = bcrypt.hashpw(PASSWORD.encode(),
+                           bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+    await insert_batches(db.database.Users, ({
+        "UserID": str(i), "Username": f"user{i}", "FirstName": "Bench",
+        "LastName": f"User{i}", "Email": f"user{i}@example.com",
+        "AccountType": "Normal user", "PaymentType": uuid4().hex,
+        "MyEvents": [], "MyTickets": [], "IsAdmin": False, "MyGenres": [],
+        "InCart": [], "Version": 0,
+    } for i in range(1, users + 1)))
+    await insert_batches(db.database.Credentials, ({
+        "UserID": str(i), "Username": f"user{i}", "credential": hashed,
+    } for i in range(1, users + 1)))
+    await insert_batches(db.database.Events, ({
+        "EventID": f"A{i}", "EventName": f"Event {i}",
+        "EventDescription": "Benchmark event", "Venue": f"Venue {i % 20}",
+        "Artists": ["Artist"], "EventDate": f"2026-{i % 12 + 1:02d}-15",
+        "EventTime": "19:00", "EventEndTime": "23:00",
+        "EventType": "Concert" if i % 2 else "Festival", "Price": 25 + i % 50,
+        "GenreID": str(i % 12), "Image": None, "Genres": ["Rock"],
+        "IsHero": i % 100 == 0, "HostName": "CouchFest", "specialNote": None,
+        "headlineArtist": "Artist", "Version": 0,
+    } for i in range(1, events + 1)))
+    await insert_batches(db.database.Tickets, ({
+        "TicketNumber": str(i), "EventID": f"A{i % events + 1}",
+        "UserID": str(i % users + 1), "PaymentMethod": "card",
+        "PurchaseDate": "2026-10-18",
+    } for i in range(1, tickets + 1)))
+
+
+async def run_scenario(name, client, make_request, requests, concurrency):
+    latencies = list()
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await make_request(client, i)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    result = {
+        "route": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+    print(f"{name:>28}: {result['throughput_rps']:9.1f} req/s  "
+          f"p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+          f"errors {errors}")
+    return result
+
+
+def scenarios(users, token):
+    auth = {"Authorization": f"Bearer {token}"}
+    run_id = uuid4().hex[:8]
+
+    async def login(client, i):
+        user = i % users + 1
+        return await client.post("/api/token", data={
+            "username": f"user{user}", "password": PASSWORD})
+
+    async def create_user(client, i):
+        return await client.post("/api/create_user", data={
+            "firstname": "New", "lastname": "User",
+            "username": f"new{run_id}{i}",
+            "email": f"new{run_id}{i}@example.com", "password": PASSWORD})
+
+    async def events(client, i):
+        return await client.get("/api/events")
+
+    async def events_page(client, i):
+        return await client.get("/api/events", params={"limit": 50})
+
+    async def me(client, i):
+        return await client.get("/api/users/me", headers=auth)
+
+    async def patch_user(client, i):
+        user = i % users + 1
+        return await client.patch(f"/api/user/id/{user}",
+                                  json={"FirstName": f"Bench{i}"})
+
+    async def patch_event(client, i):
+        return await client.patch("/api/event/id/A1",
+                                  json={"Price": i % 100})
+
+    async def delete_user(client, i):
+        return await client.delete(f"/api/user/name/new{run_id}{i}")
+
+    return [
+        ("POST /api/token", login),
+        ("POST /api/create_user", create_user),
+        ("GET /api/events", events),
+        ("GET /api/events?limit=50", events_page),
+        ("GET /api/users/me", me),
+        ("PATCH /api/user/id/{id}", patch_user),
+        ("PATCH /api/event/id/{id}", patch_event),
+        ("DELETE /api/user/name/{name}", delete_user),
+    ]
+
+
+async def run(args):
+    volume = SCALES[args.scale]
+    users = args.users or volume
+    events = args.events or volume
+    tickets = args.tickets or volume
+    mongo_client = bench_client(args.mongodb)
+    await db.connect(mongo_client, DATABASE_NAME)
+    if not args.mongodb:
+        db._supports_transactions = False
+    # The benchmark measures the routes, not the rate limits.
+    limiter.RATE_LIMITS.clear()
+    print(f"Seeding {users} users, {events} events, {tickets} tickets")
+    await seed(mongo_client, users, events, tickets)
+    # startup() keeps the client connected above.
+    await main.startup()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://bench") as client:
+        response = await client.post("/api/token", data={
+            "username": "user1", "password": PASSWORD})
+        token = response.json()["access_token"]
+        results = list()
+        for name, make_request in scenarios(users, token):
+            if args.only and not any(part in name for part in args.only):
+                continue
+            requests = args.requests
+            if "token" in name or "create_user" in name:
+                requests = min(requests, args.bcrypt_requests)
+            if "DELETE" in name:
+                # Deletes remove the users created above, one each.
+                requests = min(requests, args.bcrypt_requests)
+            results.append(await run_scenario(name, client, make_request,
+                                              requests, args.concurrency))
+    await main.shutdown()
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "backend": "mongodb" if args.mongodb else "memory",
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "volumes": {"users": users, "events": events, "tickets": tickets},
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--events", type=int)
+    parser.add_argument("--tickets", type=int)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--bcrypt-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mongodb", help="local MongoDB URL to use instead "
+                                          "of the in-memory stand-in")
+    parser.add_argument("--only", nargs="*",
+                        help="run only routes containing these strings")
+    parser.add_argument("--output", default="bench_api.json")
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,125 @@
+"""Concurrency check for ID allocation: parallel creates, no duplicates.
+
+Seeds `--existing` users the way the old ID scheme left them, with no
+counter yet, and seeds the counters from several simulated workers at
+once. It then has `--creates` registrations allocate a UserID with
+`database.generate_new_id` and insert the user and credential through
+`database.create_user_with_credential`, the same path /api/create_user
+takes. Alongside them, `--workers` ID blocks hand out contact form IDs
+the way the write-behind path does. Afterwards it checks that every ID is
+distinct and above the seeded ones, that every insert succeeded, and exits
+non-zero if not.
+
+Runs against the in-memory mongomock-motor stand-in by default. That
+interleaves creates only at await points, so use --mongodb with a local
+MongoDB to exercise real server-side contention. Either way it uses, and
+first drops, its own "couchbench" database.
+
+Run from the repository root:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_ids --creates 2000 --existing 500
+    python -m benchmarks.bench_ids --mongodb mongodb://localhost
+"""
+import argparse
+import asyncio
+import sys
+import time
+import database as db
+from benchmarks.bench_api import DATABASE_NAME, bench_client, percentile
+
+
+async def seed(mongo_client, existing, workers):
+    await mongo_client.drop_database(DATABASE_NAME)
+    await db.ensure_indexes()
+    if existing:
+        await db.database.Users.insert_many([{
+            "UserID": str(i), "Username": f"existing{i}",
+            "Email": f"existing{i}@example.com", "Version": 0,
+        } for i in range(1, existing + 1)])
+    # Every worker seeds the counters at startup.
+    await asyncio.gather(*[db.seed_counters() for _ in range(workers)])
+
+
+async def rush(creates, workers, concurrency):
+    latencies, user_ids, form_ids = list(), list(), list()
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    blocks = [db.IdBlock("ContactUs", 16) for _ in range(workers)]
+
+    async def create(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                user_id = await db.generate_new_id("Users")
+                await db.create_user_with_credential(
+                    {"UserID": user_id, "Username": f"new{i}",
+                     "Email": f"new{i}@example.com", "Version": 0},
+                    {"UserID": user_id, "Username": f"new{i}",
+                     "credential": "-"})
+                user_ids.append(user_id)
+                form_ids.append(await blocks[i % workers].next())
+            except Exception as e:
+                errors += 1
+                print(f"Create {i} failed: {e!r}")
+            finally:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[create(i) for i in range(creates)])
+    elapsed = time.perf_counter() - start
+    print(f"{creates} creates in {elapsed:.2f}s "
+          f"({creates / elapsed:.1f} creates/s), "
+          f"p50 {percentile(latencies, 50):.2f} ms, "
+          f"p99 {percentile(latencies, 99):.2f} ms, {errors} errors")
+    return user_ids, form_ids, errors
+
+
+async def verify(user_ids, form_ids, errors, creates, existing):
+    stored = await db.database.Users.count_documents({})
+    logins = await db.database.Credentials.count_documents({})
+    counts = {
+        "creates": creates,
+        "user IDs": len(user_ids),
+        "distinct user IDs": len(set(user_ids)),
+        "users stored": stored - existing,
+        "credentials stored": logins,
+        "form IDs": len(form_ids),
+        "distinct form IDs": len(set(form_ids)),
+        "lowest new user ID": min(map(int, user_ids), default=None),
+    }
+    for name, value in counts.items():
+        print(f"{name:>20}: {value}")
+    return (not errors
+            and creates == len(user_ids) == len(set(user_ids))
+            == stored - existing == logins
+            and creates == len(form_ids) == len(set(form_ids))
+            and all(int(user_id) > existing for user_id in user_ids))
+
+
+async def run(args):
+    mongo_client = bench_client(args.mongodb)
+    await db.connect(mongo_client, DATABASE_NAME)
+    if not args.mongodb:
+        db._supports_transactions = False
+    await seed(mongo_client, args.existing, args.workers)
+    user_ids, form_ids, errors = await rush(args.creates, args.workers,
+                                            args.concurrency)
+    ok = await verify(user_ids, form_ids, errors, args.creates,
+                      args.existing)
+    db.close()
+    print("OK: every ID distinct" if ok else "FAILED: duplicate or lost IDs")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--creates", type=int, default=2000)
+    parser.add_argument("--existing", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--mongodb", help="local MongoDB URL to use instead "
+                                          "of the in-memory stand-in")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
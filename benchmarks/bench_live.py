@@ -0,0 +1,188 @@
+"""Fan-out latency and resume check for the live updates stream.
+
+Opens `--subscribers` subscriptions the way /api/events/live does, makes
+`--changes` event writes (inserts, updates and deletes), and measures
+how long each change takes to reach every subscriber. Halfway through,
+one subscriber disconnects. It later reconnects with its Last-Event-ID
+and must receive exactly the changes it missed. The script exits
+non-zero if any subscriber misses a change or sees them out of order.
+
+Writes are paced by `--interval`. A subscriber more than
+LIVE_SUBSCRIBER_QUEUE changes behind is disconnected by design, so very
+short intervals with many subscribers show up as failures.
+
+By default the change stream is an in-process stand-in, built from the
+database's event-change callbacks on top of mongomock-motor. Pass
+--mongodb with a local single-node replica set to use a real change
+stream instead:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 &
+    mongosh --eval "rs.initiate()"
+    export LIVE_MONGODB="mongodb://localhost/?replicaSet=rs0"
+    python -m benchmarks.bench_live --mongodb "$LIVE_MONGODB"
+
+Either way the script uses, and first drops, its own "couchbench"
+database. Run it from the repository root.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import database as db
+import live
+from benchmarks.bench_api import DATABASE_NAME, bench_client, percentile
+
+
+class StandInChangeStream:
+    # Just enough of a Motor change stream for live.consume(), fed by
+    # database.on_event_change instead of the oplog.
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.object_ids = dict()
+        self.sequence = 0
+        db.on_event_change(self.record)
+
+    def record(self, event_id, document):
+        self.sequence += 1
+        if document is not None:
+            operation = "update" if event_id in self.object_ids else "insert"
+            self.object_ids[event_id] = document["_id"]
+        else:
+            operation = "delete"
+        self.queue.put_nowait({
+            "_id": {"_data": f"{self.sequence:016x}"},
+            "operationType": operation,
+            "ns": {"db": DATABASE_NAME, "coll": "Events"},
+            "documentKey": {"_id": self.object_ids.get(event_id)},
+            "fullDocument": document,
+        })
+
+    def __call__(self, resume_after=None):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+def parse(chunk):
+    fields = dict()
+    for line in chunk.decode().splitlines():
+        name, _, value = line.partition(": ")
+        fields[name] = value
+    return fields
+
+
+async def listen(received, queue, backlog, stop_after=None):
+    # Collects (token, message, time) until stopped or after stop_after
+    # changes, like a client that goes away.
+    async for chunk in live.stream(queue, backlog):
+        fields = parse(chunk)
+        if fields.get("event") == "change":
+            received.append((fields["id"], json.loads(fields["data"]),
+                             time.perf_counter()))
+            if stop_after and len(received) == stop_after:
+                return
+
+
+async def write(changes, interval):
+    # Cycles insert, update, delete, so every operation type is covered.
+    sent = list()
+    for i in range(changes):
+        event_id = f"L{i // 3}"
+        sent.append(time.perf_counter())
+        if i % 3 == 0:
+            await db.create_event({"EventID": event_id,
+                                   "EventName": f"Live {event_id}",
+                                   "TicketsSold": 0, "Version": 0})
+        elif i % 3 == 1:
+            await db.update_event({"EventID": event_id}, {"Price": i})
+        else:
+            await db.delete_event({"EventID": event_id})
+        await asyncio.sleep(interval)
+    return sent
+
+
+async def wait_for(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def run(args):
+    mongo_client = bench_client(args.mongodb)
+    await db.connect(mongo_client, DATABASE_NAME)
+    await mongo_client.drop_database(DATABASE_NAME)
+    source = live.watch if args.mongodb else StandInChangeStream()
+    await live.start(source)
+    if not await wait_for(lambda: live.available, 10):
+        print("Change stream did not start")
+        return False
+
+    streams = [live.subscribe() + (list(),) for _ in range(args.subscribers)]
+    half = args.changes // 2
+    listeners = [asyncio.create_task(listen(received, queue, backlog))
+                 for queue, backlog, received in streams[1:]]
+    queue, backlog, dropped = streams[0]
+    listeners.append(asyncio.create_task(
+        listen(dropped, queue, backlog, stop_after=half)))
+
+    sent = await write(args.changes, args.interval)
+    everyone = [received for _, _, received in streams[1:]]
+    complete = await wait_for(
+        lambda: all(len(r) >= args.changes for r in everyone), 30)
+
+    # The dropped subscriber comes back with the last ID it saw.
+    resumed = list()
+    queue, backlog = live.subscribe(dropped[-1][0] if dropped else None)
+    listeners.append(asyncio.create_task(listen(resumed, queue, backlog)))
+    await wait_for(lambda: len(dropped) + len(resumed) >= args.changes, 10)
+    live.stop()
+    await asyncio.gather(*listeners, return_exceptions=True)
+    db.close()
+
+    reference = [token for token, _, _ in everyone[0]] if everyone else []
+    ok = complete and len(reference) == args.changes
+    for received in everyone:
+        ok = ok and [token for token, _, _ in received] == reference
+    rejoined = [token for token, _, _ in dropped + resumed]
+    ok = ok and rejoined == reference
+    latencies = [(at - sent[index]) * 1000 for received in everyone
+                 for index, (_, _, at) in enumerate(received[:len(sent)])]
+    operations = {message["operation"] for _, message, _ in
+                  (everyone[0] if everyone else [])}
+    print(f"{args.changes} changes to {args.subscribers} subscribers: "
+          f"p50 {percentile(latencies, 50):.2f} ms, "
+          f"p99 {percentile(latencies, 99):.2f} ms, "
+          f"operations {sorted(operations)}")
+    print(f"Dropped subscriber got {len(dropped)} changes before leaving "
+          f"and {len(resumed)} after resuming")
+    print("OK: every change delivered in order" if ok
+          else "FAILED: missing or out-of-order changes")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=200)
+    parser.add_argument("--changes", type=int, default=300)
+    parser.add_argument("--interval", type=float, default=0.005,
+                        help="seconds between writes; subscribers that "
+                             "fall too far behind are cut off by design")
+    parser.add_argument("--mongodb", help="local replica set URL to use "
+                                          "instead of the in-memory stand-in")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
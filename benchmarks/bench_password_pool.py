@@ -0,0 +1,73 @@
+"""Event-loop lag seen by other requests while logins are being checked.
+
+A probe coroutine sleeps in short intervals and records how late it wakes
+up; that delay is what a cheap route such as /api/events would wait on the
+same worker. Logins are run inline (bcrypt on the event loop, as before)
+and through the passwords pool.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_password_pool --logins 16
+"""
+import argparse
+import asyncio
+import time
+import bcrypt
+import passwords
+from constants import BCRYPT_ROUNDS
+
+PROBE_INTERVAL = 0.005
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+async def probe(stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lag = time.perf_counter() - start - PROBE_INTERVAL
+        samples.append(lag * 1000)
+
+
+async def inline_login(password, hashed):
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+async def pooled_login(password, hashed):
+    return await passwords.verify_password(password, hashed)
+
+
+async def measure(name, login, logins, hashed):
+    stop = asyncio.Event()
+    samples = list()
+    probe_task = asyncio.create_task(probe(stop, samples))
+    await asyncio.sleep(PROBE_INTERVAL)
+    start = time.perf_counter()
+    await asyncio.gather(*[login("secret", hashed) for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    print(f"{name:>8}: {logins} logins in {elapsed * 1000:8.1f} ms | "
+          f"loop lag p50 {percentile(samples, 50):7.1f} ms "
+          f"p99 {percentile(samples, 99):7.1f} ms "
+          f"max {max(samples or [0]):7.1f} ms")
+
+
+async def main(logins):
+    hashed = bcrypt.hashpw(b"secret", bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+    await measure("inline", inline_login, logins, hashed)
+    await measure("pooled", pooled_login, logins, hashed)
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins))
@@ -0,0 +1,83 @@
+"""Serialization cost per list response, old path versus fast path.
+
+Builds synthetic Events documents and times, per batch:
+
+- model: models.Events(**doc).dict() per document, then jsonable_encoder
+  and the stock JSONResponse (the previous fetch_events + route path)
+- shape: database.shape() per document, then jsonable_encoder and
+  JSONResponse
+- fast: database.shape() per document rendered by FastJSONResponse
+
+Run from the repository root:
+
+    python -m benchmarks.bench_serialization --docs 10000
+"""
+import argparse
+import time
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import database as db
+import models
+from responses import FastJSONResponse
+
+
+def make_events(count):
+    return [{
+        "_id": ObjectId(),
+        "EventID": f"A{i}",
+        "EventName": f"Event {i}",
+        "EventDescription": "An evening of music. " * 8,
+        "Venue": "Main Stage",
+        "Artists": ["Artist One", "Artist Two", "Artist Three"],
+        "EventDate": "2026-10-18",
+        "EventTime": "19:00",
+        "EventEndTime": "23:00",
+        "EventType": "Concert",
+        "Price": 49.5,
+        "GenreID": str(i % 12),
+        "Image": f"https://example.com/{i}.jpg",
+        "Genres": ["Rock", "Indie"],
+        "IsHero": i % 50 == 0,
+        "HostName": "CouchFest",
+        "specialNote": None,
+        "headlineArtist": "Artist One",
+        "Version": 0,
+    } for i in range(count)]
+
+
+def model_path(docs):
+    items = [models.Events(**doc).dict(by_alias=True) for doc in docs]
+    return JSONResponse(content=jsonable_encoder(items)).body
+
+
+def shape_path(docs):
+    items = [db.shape("Events", doc) for doc in docs]
+    return JSONResponse(content=jsonable_encoder(items)).body
+
+
+def fast_path(docs):
+    items = [db.shape("Events", doc) for doc in docs]
+    return FastJSONResponse(content=items).body
+
+
+def timed(function, docs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(docs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    docs = make_events(args.docs)
+    for name, function in (("model", model_path), ("shape", shape_path),
+                           ("fast", fast_path)):
+        millis = timed(function, docs, args.repeat)
+        print(f"{name:>6}: {millis:8.1f} ms per {args.docs} documents")
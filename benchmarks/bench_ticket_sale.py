@@ -0,0 +1,127 @@
+"""On-sale stress test: many buyers, one event, no oversell.
+
+Seeds one event with `--capacity` tickets and `--buyers` users, then has
+every buyer try to purchase 1..`--max-quantity` tickets at once through
+`database.purchase_tickets`, the same path the purchase route uses. Once
+the rush is over it checks that the event's TicketsSold, the issued
+Tickets, the buyers' MyTickets and the successful orders all agree and
+never exceed the capacity, and exits non-zero if they do not.
+
+Runs against the in-memory mongomock-motor stand-in by default. That
+interleaves buyers only at await points, so use --mongodb with a local
+MongoDB (ideally a replica set, for the transactional path) to exercise
+real server-side contention. Either way it uses, and first drops, its
+own "couchbench" database.
+
+Run from the repository root:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_ticket_sale --capacity 500 --buyers 2000
+    python -m benchmarks.bench_ticket_sale --mongodb mongodb://localhost
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import database as db
+from benchmarks.bench_api import DATABASE_NAME, bench_client, percentile
+
+EVENT_ID = "A1"
+
+
+async def seed(mongo_client, capacity, buyers):
+    await mongo_client.drop_database(DATABASE_NAME)
+    await db.ensure_indexes()
+    await db.database.Events.insert_one({
+        "EventID": EVENT_ID, "EventName": "On-sale", "Capacity": capacity,
+        "TicketsSold": 0, "Version": 0,
+    })
+    await db.database.Users.insert_many([{
+        "UserID": str(i), "Username": f"buyer{i}",
+        "Email": f"buyer{i}@example.com", "MyTickets": [], "Version": 0,
+    } for i in range(1, buyers + 1)])
+
+
+async def rush(buyers, max_quantity, concurrency):
+    latencies, orders = list(), list()
+    sold_out = errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def buy(user_id):
+        nonlocal sold_out, errors
+        quantity = random.randint(1, max_quantity)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await db.purchase_tickets(EVENT_ID, user_id,
+                                                   quantity, "card")
+            except Exception as e:
+                errors += 1
+                print(f"Purchase by {user_id} failed: {e!r}")
+                return
+            finally:
+                latencies.append((time.perf_counter() - start) * 1000)
+        if result:
+            orders.append((user_id, [t["TicketNumber"] for t in result[1]]))
+        else:
+            sold_out += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[buy(str(i)) for i in range(1, buyers + 1)])
+    elapsed = time.perf_counter() - start
+    print(f"{buyers} buyers in {elapsed:.2f}s "
+          f"({buyers / elapsed:.1f} orders/s), "
+          f"p50 {percentile(latencies, 50):.2f} ms, "
+          f"p99 {percentile(latencies, 99):.2f} ms")
+    print(f"{len(orders)} orders filled, {sold_out} sold out, "
+          f"{errors} errors")
+    return orders
+
+
+async def verify(orders, capacity):
+    event = await db.database.Events.find_one({"EventID": EVENT_ID})
+    issued = await db.database.Tickets.count_documents({"EventID": EVENT_ID})
+    numbers = [number for _, tickets in orders for number in tickets]
+    held = 0
+    async for user in db.database.Users.find({}, {"MyTickets": 1}):
+        held += len(user.get("MyTickets") or [])
+    counts = {
+        "capacity": capacity,
+        "TicketsSold": event.get("TicketsSold"),
+        "tickets issued": issued,
+        "tickets in orders": len(numbers),
+        "distinct ticket numbers": len(set(numbers)),
+        "tickets in MyTickets": held,
+    }
+    for name, value in counts.items():
+        print(f"{name:>24}: {value}")
+    sold = counts["TicketsSold"]
+    return (sold <= capacity
+            and issued == len(numbers) == len(set(numbers)) == held == sold)
+
+
+async def run(args):
+    mongo_client = bench_client(args.mongodb)
+    await db.connect(mongo_client, DATABASE_NAME)
+    if not args.mongodb:
+        db._supports_transactions = False
+    await seed(mongo_client, args.capacity, args.buyers)
+    await db.seed_counters()
+    orders = await rush(args.buyers, args.max_quantity, args.concurrency)
+    ok = await verify(orders, args.capacity)
+    db.close()
+    print("OK: no oversell" if ok else "FAILED: inventory mismatch")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capacity", type=int, default=500)
+    parser.add_argument("--buyers", type=int, default=2000)
+    parser.add_argument("--max-quantity", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--mongodb", help="local MongoDB URL to use instead "
+                                          "of the in-memory stand-in")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
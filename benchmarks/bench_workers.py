@@ -0,0 +1,114 @@
+"""Throughput scaling with the number of serve.py worker processes.
+
+For each worker count, starts `python serve.py` on a local port, waits for
+it to answer, drives the given routes with concurrent clients for a fixed
+duration and reports requests per second. The app connects to MongoDB
+at startup, so MONGODB_CONN (and MODE) must point at a reachable, seeded
+database. GET /api does not touch it and shows the framework-only
+ceiling; --login adds POST /api/token, which shows how bcrypt-bound
+logins scale across processes.
+
+Run from the repository root:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_workers --workers 1 2 4 --path /api/events
+    python -m benchmarks.bench_workers --login user1:benchmark
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import httpx
+
+PORT = 5099
+
+
+async def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{url}/api")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+async def drive(url, make_request, concurrency, duration):
+    done = 0
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits,
+                                 timeout=30) as client:
+        async def worker():
+            nonlocal done, errors
+            while time.monotonic() < deadline:
+                response = await make_request(client)
+                done += 1
+                if response.status_code >= 400:
+                    errors += 1
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return done / duration, errors
+
+
+def requests_for(args):
+    routes = list()
+    for path in args.path:
+        async def get(client, path=path):
+            return await client.get(path)
+        routes.append((f"GET {path}", get))
+    if args.login:
+        username, password = args.login.split(":", 1)
+
+        async def login(client):
+            return await client.post("/api/token", data={
+                "username": username, "password": password})
+        routes.append(("POST /api/token", login))
+    return routes
+
+
+async def run(args):
+    url = f"http://127.0.0.1:{PORT}"
+    results = list()
+    for workers in args.workers:
+        # Rate limits off for the login route: it is measured, not limited.
+        env = dict(os.environ, PORT=str(PORT), HOST="127.0.0.1",
+                   WEB_CONCURRENCY=str(workers),
+                   RATE_LIMITS=json.dumps({"/api/token": {}}))
+        server = subprocess.Popen([sys.executable, "serve.py"], env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            await wait_until_ready(url)
+            for name, make_request in requests_for(args):
+                rps, errors = await drive(url, make_request,
+                                          args.concurrency, args.duration)
+                print(f"workers {workers:>2} {name:>20}: {rps:9.1f} req/s  "
+                      f"errors {errors}")
+                results.append({"workers": workers, "route": name,
+                                "throughput_rps": round(rps, 1),
+                                "errors": errors})
+        finally:
+            server.terminate()
+            server.wait()
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--path", nargs="+", default=["/api"])
+    parser.add_argument("--login", help="username:password for /api/token")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--output", default="bench_workers.json")
+    args = parser.parse_args()
+    asyncio.run(run(args))
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # Size-bounded LRU whose entries also expire after `ttl` seconds.
+    # A reader takes version(key) before loading a value and must not
+    # cache what it loaded if the version changed meanwhile. delete()
+    # only changes the version of its own key; delete_where() and clear()
+    # change every key's, through `generation`.
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data = OrderedDict()
+        # Deletes per key, for the most recently deleted max_size keys.
+        self._deletes = OrderedDict()
+
+    def version(self, key):
+        return self.generation, self._deletes.get(key, 0)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._data[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+        self._deletes[key] = self._deletes.get(key, 0) + 1
+        self._deletes.move_to_end(key)
+        if len(self._deletes) > self.max_size:
+            # A forgotten count could repeat a version a reader took, so
+            # every key's version changes instead.
+            self._deletes.popitem(last=False)
+            self.generation += 1
+
+    def delete_where(self, predicate):
+        # Loads in progress may be for matching keys that are not cached
+        # yet, so this invalidates them all.
+        self.generation += 1
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+        }
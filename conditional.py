@@ -0,0 +1,68 @@
+import hashlib
+from fastapi import Request, Response
+from responses import FastJSONResponse
+
+
+def etag_for(body):
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def render(content):
+    # JSON body and ETag, for callers that keep them between requests.
+    body = FastJSONResponse(content=content).body
+    return body, etag_for(body)
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+class ConditionalGet:
+    def __init__(self, request, max_age=0, private=False):
+        self.request = request
+        scope = "private" if private else "public"
+        freshness = f"max-age={max_age}" if max_age else "no-cache"
+        self.cache_control = f"{scope}, {freshness}"
+
+    def respond(self, content, status_code=200):
+        response = FastJSONResponse(status_code=status_code, content=content)
+        return self.finish(response, etag_for(response.body))
+
+    def respond_body(self, body, etag):
+        # For JSON serialized ahead of time, along with its ETag.
+        return self.finish(Response(body, media_type="application/json"),
+                           etag)
+
+    def respond_tagged(self, content, etag):
+        # For content whose ETag is known without serializing it, such as
+        # one built from a document version: a match costs no rendering.
+        if self.matches(etag):
+            return self.not_modified(etag)
+        return self.finish(FastJSONResponse(content=content), etag)
+
+    def matches(self, etag):
+        return etag_matches(self.request.headers.get("if-none-match"), etag)
+
+    def headers(self, etag):
+        return {"ETag": etag, "Cache-Control": self.cache_control}
+
+    def not_modified(self, etag):
+        return Response(status_code=304, headers=self.headers(etag))
+
+    def finish(self, response, etag):
+        if self.matches(etag):
+            return self.not_modified(etag)
+        response.headers.update(self.headers(etag))
+        return response
+
+
+def conditional_get(max_age=0, private=False):
+    # Route dependency: `cond: ConditionalGet = Depends(conditional_get())`
+    # and then `return cond.respond(content)`.
+    def dependency(request: Request):
+        return ConditionalGet(request, max_age, private)
+    return dependency
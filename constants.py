@@ -1,5 +1,77 @@
+import json
 import os
 
-MODE = 1
+MODE = int(os.environ.get("MODE", "1"))
 PROD_DB = os.environ.get("MONGODB_CONN")
 TEST_DB = os.environ.get("MONGODB_TEST")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.environ.get("BCRYPT_MAX_PENDING", "32"))
+DB_DIAGNOSTICS = os.environ.get("DB_DIAGNOSTICS") == "1"
+SLOW_QUERY_MS = int(os.environ.get("SLOW_QUERY_MS", "100"))
+EVENT_CACHE_TTL = float(os.environ.get("EVENT_CACHE_TTL", "30"))
+EVENT_CACHE_SIZE = int(os.environ.get("EVENT_CACHE_SIZE", "1024"))
+CATALOG_MAX_AGE = int(os.environ.get("CATALOG_MAX_AGE", "0"))
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", "10000"))
+JWT_PROFILE_CLAIMS = os.environ.get("JWT_PROFILE_CLAIMS") == "1"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_SAMPLE = os.environ.get("LOG_SAMPLE", "")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS",
+                                              "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "0"))
+MONGO_COMPRESSORS = os.environ.get("MONGO_COMPRESSORS", "")
+MONGO_CATALOG_READ_PREFERENCE = os.environ.get(
+    "MONGO_CATALOG_READ_PREFERENCE", "primary")
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "5000"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+# Proxies trusted to set X-Forwarded-For, passed to uvicorn as
+# forwarded_allow_ips. Not "*": uvicorn then takes the leftmost entry,
+# which the client writes itself.
+FORWARDED_ALLOW_IPS = os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+# For proxies without fixed addresses, such as the Heroku router: how many
+# of them append to X-Forwarded-For. The client is the entry that many
+# hops from the right.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+MAX_BULK_SIZE = int(os.environ.get("MAX_BULK_SIZE", "5000"))
+# Each new user costs a bcrypt hash, a quarter second or so at cost 12,
+# so user batches are capped far lower.
+MAX_BULK_USERS = int(os.environ.get("MAX_BULK_USERS", "50"))
+MAX_TICKETS_PER_ORDER = int(os.environ.get("MAX_TICKETS_PER_ORDER", "10"))
+FEED_RAIL_SIZE = int(os.environ.get("FEED_RAIL_SIZE", "12"))
+FEED_REFRESH_SECONDS = int(os.environ.get("FEED_REFRESH_SECONDS", "60"))
+LIVE_COLLECTIONS = [name for name in os.environ.get(
+    "LIVE_COLLECTIONS", "Events").split(",") if name]
+LIVE_BUFFER_SIZE = int(os.environ.get("LIVE_BUFFER_SIZE", "1000"))
+LIVE_SUBSCRIBER_QUEUE = int(os.environ.get("LIVE_SUBSCRIBER_QUEUE", "100"))
+LIVE_HEARTBEAT_SECONDS = int(os.environ.get("LIVE_HEARTBEAT_SECONDS", "15"))
+# Route -> {scope: "requests/seconds"}; RATE_LIMITS (JSON) overrides
+# whole routes, e.g. {"/api/token": {"ip": "60/60", "username": "5/60"}}.
+RATE_LIMITS = {
+    "/api/token": {"ip": "30/60", "username": "10/60"},
+    "/api/user/authenticate": {"ip": "30/60", "username": "10/60"},
+    "/api/create_user": {"ip": "10/60"},
+    "/api/users/bulk": {"ip": "5/60"},
+    "/api/save_contact_us/": {"ip": "10/60"},
+}
+RATE_LIMITS.update(json.loads(os.environ.get("RATE_LIMITS", "{}")))
+LIMITER_BACKEND = os.environ.get("LIMITER_BACKEND", "memory")
+LIMITER_MAX_KEYS = int(os.environ.get("LIMITER_MAX_KEYS", "100000"))
+ADMISSION_CONCURRENCY = int(os.environ.get("ADMISSION_CONCURRENCY",
+                                           str(BCRYPT_MAX_PENDING)))
+CONTACT_WRITE_BEHIND = os.environ.get("CONTACT_WRITE_BEHIND") == "1"
+CONTACT_BATCH_SIZE = int(os.environ.get("CONTACT_BATCH_SIZE", "500"))
+CONTACT_FLUSH_SECONDS = float(os.environ.get("CONTACT_FLUSH_SECONDS", "1"))
+CONTACT_MAX_PENDING = int(os.environ.get("CONTACT_MAX_PENDING", "10000"))
+CONTACT_SUBMIT_TIMEOUT = float(os.environ.get("CONTACT_SUBMIT_TIMEOUT",
+                                              "2"))
+CONTACT_ID_BLOCK = int(os.environ.get("CONTACT_ID_BLOCK", "100"))
@@ -1,22 +1,462 @@
 # from os import environ
+import asyncio
+import base64
+import binascii
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
 import motor.motor_asyncio
-from constants import TEST_DB, PROD_DB, MODE
+from bson import Decimal128, ObjectId
+from bson import json_util
+from bson.errors import InvalidId, InvalidDocument
+from pymongo import ReadPreference, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError, OperationFailure, BulkWriteError
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
+from pymongo.errors import WriteConcernError
+from constants import TEST_DB, PROD_DB, MODE, DB_DIAGNOSTICS
+from constants import MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE
+from constants import MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS
+from constants import MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_COMPRESSORS
+from constants import MONGO_CATALOG_READ_PREFERENCE
+from constants import EVENT_CACHE_SIZE, EVENT_CACHE_TTL
+from constants import PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL
+from cache import TTLCache
+import diagnostics
+import metrics
 import models
-import logging
-
-logger = logging.getLogger("database")
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler("database.log")
-logger.addHandler(file_handler)
-formatter = logging.Formatter("%(asctime)s: "
-                              "%(levelname)s: "
-                              "%(name)s: "
-                              "%(message)s")
-file_handler.setFormatter(formatter)
+import logs
+
+logger = logs.get_logger("database", "database.log")
 
 mongo_connection = PROD_DB if MODE == 1 else TEST_DB
-client = motor.motor_asyncio.AsyncIOMotorClient(mongo_connection)
-database = client.CouchFest if MODE == 1 else client.couchtest
+
+# Set by connect() during app startup and cleared by close(). `catalog` is
+# the handle for uncached event catalog reads, which may go to
+# secondaries; reads that fill event_cache, auth reads and all writes use
+# `database` on the primary.
+client = None
+database = None
+catalog = None
+_supports_transactions = None
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+
+def client_options():
+    event_listeners = [metrics.CommandMetrics()]
+    if DB_DIAGNOSTICS:
+        event_listeners.append(diagnostics.SlowCommandListener())
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": event_listeners,
+    }
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+async def connect(mongo_client=None, database_name=None):
+    # Tools and benchmarks can supply their own client and database name.
+    global client, database, catalog, _supports_transactions
+    if client is not None:
+        return
+    client = mongo_client or motor.motor_asyncio.AsyncIOMotorClient(
+        mongo_connection, **client_options())
+    if database_name is None:
+        database_name = "CouchFest" if MODE == 1 else "couchtest"
+    database = client[database_name]
+    catalog = database
+    if MONGO_CATALOG_READ_PREFERENCE != "primary":
+        catalog = database.with_options(
+            read_preference=READ_PREFERENCES[MONGO_CATALOG_READ_PREFERENCE])
+    _supports_transactions = None
+    if mongo_client is None:
+        start = time.perf_counter()
+        try:
+            await client.admin.command("ping")
+            millis = (time.perf_counter() - start) * 1000
+            logger.info(f"MongoDB ping: {millis:.1f} ms")
+        except PyMongoError as e:
+            logger.error(f"MongoDB warm-up ping failed: {e}")
+
+
+def close():
+    global client, database, catalog
+    if client is not None:
+        client.close()
+    client = database = catalog = None
+
+
+def _reset_after_fork():
+    # A client inherited through fork() must not be used by the child.
+    global client, database, catalog, _supports_transactions
+    client = database = catalog = _supports_transactions = None
+    event_cache.clear()
+    principal_cache.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Catalog cache keyed by ("id", EventID), ("name", EventName) and ("all",)
+# for the unfiltered list. Every event write clears it; other workers see
+# the change once their entries expire.
+event_cache = TTLCache(EVENT_CACHE_SIZE, EVENT_CACHE_TTL)
+
+# Authenticated users keyed by (UserID, token). User writes drop every
+# entry for that UserID.
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+
+def cache_stats():
+    return {
+        "events": event_cache.stats(),
+        "principals": principal_cache.stats(),
+    }
+
+
+def _cache_values(key):
+    return {(name,): stats[key] for name, stats in cache_stats().items()}
+
+
+metrics.CallbackCounter("cache_hits_total", "Cache hits.", ("cache",),
+                        lambda: _cache_values("hits"))
+metrics.CallbackCounter("cache_misses_total", "Cache misses.", ("cache",),
+                        lambda: _cache_values("misses"))
+metrics.CallbackGauge("cache_entries", "Entries held per cache.", ("cache",),
+                      lambda: _cache_values("size"))
+
+
+def forget_principal(user_id):
+    principal_cache.delete_where(lambda key: key[0] == user_id)
+
+
+# Callbacks run after every event write as callback(event_id, document).
+# document is None for a delete; event_id is None after a bulk write,
+# which may have changed any number of events.
+event_listeners = list()
+
+
+def on_event_change(callback):
+    event_listeners.append(callback)
+
+
+def notify_event_change(event_id, document=None):
+    for callback in event_listeners:
+        callback(event_id, document)
+
+
+# Collection -> [(keys, options)] created at startup. The (ID, _id)
+# indexes back the keyset pagination sort.
+INDEXES = {
+    "Users": [
+        ([("UserID", 1)], {"unique": True}),
+        ([("Username", 1)], {"unique": True}),
+        ([("Email", 1)], {"unique": True}),
+        ([("UserID", 1), ("_id", 1)], {}),
+    ],
+    "Credentials": [
+        ([("Username", 1)], {"unique": True}),
+        ([("UserID", 1)], {}),
+    ],
+    "Events": [
+        ([("EventID", 1)], {"unique": True}),
+        ([("EventName", 1)], {"unique": True}),
+        ([("EventID", 1), ("_id", 1)], {}),
+        # Search: equality filter first, then the default EventDate sort,
+        # which also serves the date range.
+        ([("EventDate", 1), ("_id", 1)], {}),
+        ([("GenreID", 1), ("EventDate", 1), ("_id", 1)], {}),
+        ([("Genres", 1), ("EventDate", 1), ("_id", 1)], {}),
+        ([("EventType", 1), ("EventDate", 1), ("_id", 1)], {}),
+        ([("Venue", 1), ("EventDate", 1), ("_id", 1)], {}),
+        ([("Artists", 1), ("EventDate", 1), ("_id", 1)], {}),
+        ([("IsHero", 1), ("EventDate", 1), ("_id", 1)], {}),
+        ([("Price", 1), ("_id", 1)], {}),
+        ([("EventName", 1), ("_id", 1)], {}),
+        ([("EventName", "text"), ("EventDescription", "text")],
+         {"weights": {"EventName": 5, "EventDescription": 1},
+          "name": "EventText"}),
+    ],
+    "ContactUs": [
+        ([("FormID", 1)], {"unique": True}),
+        ([("FormID", 1), ("_id", 1)], {}),
+    ],
+    "RateLimits": [
+        ([("expireAt", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "SalesRollups": [
+        ([("Kind", 1), ("Key", 1)], {}),
+        ([("Kind", 1), ("Tickets", -1)], {}),
+        ([("Kind", 1), ("Revenue", -1)], {}),
+    ],
+    "Tickets": [
+        ([("TicketNumber", 1)], {"unique": True}),
+        ([("EventID", 1)], {}),
+        ([("UserID", 1)], {}),
+        ([("TicketNumber", 1), ("_id", 1)], {}),
+    ],
+}
+
+
+async def ensure_indexes():
+    # create_index is a no-op for an index that already exists, so this
+    # is safe to run on every startup. The unique indexes are the only
+    # guard against duplicate IDs, usernames, emails and event names, so
+    # startup fails without them; typically existing duplicates have to
+    # be cleaned up first.
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await database[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                logger.error(f"Could not create index {keys} on "
+                             f"{collection}: {e}")
+                if options.get("unique"):
+                    raise
+    logger.info("Indexes ensured")
+
+
+# Sequence name -> (collection, ID field, prefix) for IDs handed out by
+# the Counters collection.
+SEQUENCES = {
+    "Users": ("Users", "UserID", ""),
+    "Events": ("Events", "EventID", "A"),
+    "ContactUs": ("ContactUs", "FormID", ""),
+    "Tickets": ("Tickets", "TicketNumber", ""),
+}
+
+
+async def next_sequence(name, count=1):
+    # Returns the last of `count` consecutive numbers reserved at once.
+    doc = await database.Counters.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc.get("seq")
+
+
+async def generate_new_id(name):
+    logger.info(f"Generating new ID for {name}")
+    _, _, prefix = SEQUENCES[name]
+    seq = await next_sequence(name)
+    return f"{prefix}{seq}"
+
+
+async def generate_new_ids(name, count):
+    logger.info(f"Generating {count} new IDs for {name}")
+    if count < 1:
+        return []
+    _, _, prefix = SEQUENCES[name]
+    last = await next_sequence(name, count)
+    return [f"{prefix}{seq}" for seq in range(last - count + 1, last + 1)]
+
+
+async def advance_sequence(name, ids):
+    # Moves the counter past IDs a client chose itself, so they are never
+    # handed out again later.
+    _, _, prefix = SEQUENCES[name]
+    highest = max((_sequence_number(value, prefix) for value in ids
+                   if str(value).startswith(prefix)), default=0)
+    if highest > 0:
+        await database.Counters.update_one(
+            {"_id": name}, {"$max": {"seq": highest}}, upsert=True)
+
+
+class IdBlock:
+    # Hands out IDs from blocks reserved with one counter increment. IDs
+    # still unused when the process exits are skipped, never reused.
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.ids = deque()
+
+    async def next(self):
+        if not self.ids:
+            self.ids.extend(await generate_new_ids(self.name, self.size))
+        return self.ids.popleft()
+
+
+def _sequence_number(value, prefix):
+    try:
+        return int(str(value)[len(prefix):])
+    except (TypeError, ValueError):
+        return 0
+
+
+async def seed_counters():
+    # One-time seeding: a counter that does not exist yet starts at the
+    # highest ID already stored. $max keeps concurrent seeding harmless.
+    for name, (collection, identifier, prefix) in SEQUENCES.items():
+        if await database.Counters.find_one({"_id": name}):
+            continue
+        current = 0
+        cursor = database[collection].find({}, {identifier: 1, "_id": 0})
+        async for doc in cursor:
+            current = max(current,
+                          _sequence_number(doc.get(identifier), prefix))
+        await database.Counters.update_one(
+            {"_id": name}, {"$max": {"seq": current}}, upsert=True)
+        logger.info(f"Counter {name} seeded at {current}")
+
+
+# Collection -> the fields its model exposes. Reads project to these and
+# build plain dicts instead of constructing a model per document.
+FIELDS = {
+    "Users": list(models.Users.__fields__),
+    "Events": list(models.Events.__fields__),
+    "Tickets": list(models.Tickets.__fields__),
+    "ContactUs": list(models.ContactUs.__fields__),
+}
+
+
+def projection(collection, with_id=False):
+    fields = {field: 1 for field in FIELDS[collection]}
+    if not with_id:
+        fields["_id"] = 0
+    return fields
+
+
+def shape(collection, doc):
+    return {field: doc.get(field) for field in FIELDS[collection]}
+
+
+# Collection -> ID field, used for keyset pagination and bulk results.
+ID_FIELDS = {
+    "Users": "UserID",
+    "Events": "EventID",
+    "Tickets": "TicketNumber",
+    "ContactUs": "FormID",
+    "Credentials": "UserID",
+}
+
+
+def encode_cursor(value, object_id):
+    # Extended JSON, so dates, Decimal128 prices and the like come back
+    # from decode_cursor() as the same BSON types.
+    raw = json_util.dumps([value, object_id],
+                          json_options=json_util.CANONICAL_JSON_OPTIONS)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode())
+        value, object_id = json_util.loads(raw)
+        return value, ObjectId(object_id)
+    except (binascii.Error, ValueError, TypeError, InvalidId):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+# BSON types in MongoDB's sort order, as $type aliases. Comparisons like
+# $gt only match values of the same group, so keyset pages need these to
+# reach values of the other types. Types no API write can store (minKey,
+# symbol, timestamp, regex, maxKey) are left out.
+TYPE_ORDER = [
+    ["null"],
+    ["int", "long", "double", "decimal"],
+    ["string"],
+    ["object"],
+    ["array"],
+    ["binData"],
+    ["objectId"],
+    ["bool"],
+    ["date"],
+]
+NULL_RANK = 0
+# Python type -> position in TYPE_ORDER; bool before int, its base class.
+TYPE_RANKS = [
+    (bool, 7), ((int, float, Decimal128), 1), (str, 2), (dict, 3),
+    ((list, tuple), 4), (bytes, 5), (ObjectId, 6), (datetime, 8),
+]
+
+
+def _type_rank(value):
+    # Position of value's type in TYPE_ORDER, or None if it is unknown.
+    if value is None:
+        return NULL_RANK
+    for types, rank in TYPE_RANKS:
+        if isinstance(value, types):
+            return rank
+    return None
+
+
+def after_key(field, direction, value, object_id):
+    # Documents strictly after (value, object_id) in (field, _id) order:
+    # equal values with a later _id, later values of the same type, and
+    # every value of a type that sorts after this one. Nulls sort before
+    # every other type and also stand for missing fields, which $type
+    # does not match, so they get their own branch. Each $type clause
+    # names one alias, which is all mongomock understands.
+    op = "$gt" if direction > 0 else "$lt"
+    branches = [{field: value, "_id": {op: object_id}}]
+    if value is not None:
+        branches.append({field: {op: value}})
+    rank = _type_rank(value)
+    if rank is None:
+        others = list()
+    elif direction > 0:
+        others = TYPE_ORDER[rank + 1:]
+    else:
+        others = TYPE_ORDER[NULL_RANK + 1:rank]
+        if rank > NULL_RANK:
+            branches.append({field: None})
+    branches.extend({field: {"$type": alias}}
+                    for types in others for alias in types)
+    return {"$or": branches}
+
+
+async def fetch_page(collection, limit, after=None, query=None, sort=None):
+    # `sort` is a (field, direction) pair, by default the ID ascending;
+    # _id breaks ties so the order, and so every cursor, is total.
+    field, direction = sort or (ID_FIELDS[collection], 1)
+    query = query or {}
+    if after:
+        value, object_id = decode_cursor(after)
+        keyset = after_key(field, direction, value, object_id)
+        query = {"$and": [query, keyset]} if query else keyset
+    source = catalog if collection == "Events" else database
+    cursor = source[collection].find(
+        query, projection(collection, with_id=True))
+    cursor = cursor.sort([(field, direction), ("_id", direction)])
+    cursor = cursor.limit(limit + 1)
+    items, next_cursor, last = list(), None, None
+    async for doc in cursor:
+        if len(items) == limit:
+            next_cursor = encode_cursor(last.get(field), last["_id"])
+            break
+        items.append(shape(collection, doc))
+        last = doc
+    return {"items": items, "next": next_cursor}
+
+
+# Search sort name -> (field, direction); every one is index-backed.
+EVENT_SORTS = {
+    "date": ("EventDate", 1),
+    "-date": ("EventDate", -1),
+    "price": ("Price", 1),
+    "-price": ("Price", -1),
+    "name": ("EventName", 1),
+    "-name": ("EventName", -1),
+}
+
+
+async def search_events(query, sort="date", limit=None, after=None):
+    return await fetch_page("Events", limit, after, query, EVENT_SORTS[sort])
 
 
 async def fetch_user(prop, by_id=True):
@@ -27,6 +467,19 @@ async def fetch_user(prop, by_id=True):
     return doc
 
 
+async def fetch_principal(user_id, token):
+    cached = principal_cache.get((user_id, token))
+    if cached is not None:
+        return dict(cached)
+    version = principal_cache.version((user_id, token))
+    doc = await fetch_user(user_id)
+    if doc and principal_cache.version((user_id, token)) == version:
+        principal_cache.set((user_id, token), doc)
+    if doc:
+        return dict(doc)
+    return doc
+
+
 async def fetch_credential(username):
     logger.info(f"Fetching credential for: {username}")
     query = {"Username": username}
@@ -40,11 +493,11 @@ async def fetch_user_by_email(user_email):
     return doc
 
 
-async def fetch_users():
+async def fetch_users(query=None):
     users = list()
-    cursor = database.Users.find({})
+    cursor = database.Users.find(query or {}, projection("Users"))
     async for doc in cursor:
-        users.append(models.Users(**doc).dict(by_alias=True))
+        users.append(shape("Users", doc))
     return users
 
 
@@ -72,90 +525,458 @@ async def add_credential(user_object):
     return None
 
 
-async def update_user(criteria, user_object):
-    result = await database.Users.update_one(criteria, {"$set": user_object})
-    if result:
-        document = await database.Users.find_one(criteria)
+async def supports_transactions():
+    global _supports_transactions
+    if _supports_transactions is None:
+        try:
+            hello = await client.admin.command("hello")
+        except PyMongoError:
+            hello = {}
+        # Transactions need a replica set member or a mongos router.
+        _supports_transactions = bool(hello.get("setName")
+                                      or hello.get("msg") == "isdbgrid")
+        logger.info(f"Transactions supported: {_supports_transactions}")
+    return _supports_transactions
+
+
+async def run_in_transaction(operation):
+    if not await supports_transactions():
+        return await operation(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(operation)
+
+
+async def delete_document(collection, criteria, session=None):
+    document = await database[collection].find_one_and_delete(
+        criteria, session=session)
+    if document:
+        logger.info(f"1 document deleted from {collection}.")
+    return document
+
+
+async def delete_user_with_credential(criteria):
+    async def _delete(session):
+        document = await delete_user(criteria, session)
+        if document:
+            await delete_credential({"UserID": document.get("UserID")},
+                                    session)
         return document
-    return None
+    return await run_in_transaction(_delete)
 
 
-async def delete_user(criteria):
-    count_prev = await database.Users.count_documents({})
-    document = await database.Users.find_one(criteria)
-    result = await database.Users.delete_one(criteria)
-    if result:
-        count_now = await database.Users.count_documents({})
-        _diff = count_prev - count_now
-        _message = "document" if _diff == 1 else "documents"
-        logger.info(f"{_diff} {_message} deleted from Users.")
-        if _diff == 1:
-            return document
-        return None
-    return None
+async def create_user_with_credential(user_object, credential_object):
+    async def _create(session):
+        await database.Users.insert_one(user_object, session=session)
+        try:
+            await database.Credentials.insert_one(credential_object,
+                                                  session=session)
+        except PyMongoError:
+            # Without a transaction, undo the user insert by hand.
+            if session is None:
+                await database.Users.delete_one({"_id": user_object["_id"]})
+            raise
+        logger.info("User and credential added!")
+        return user_object
+    return await run_in_transaction(_create)
 
 
-async def delete_credential(criteria):
-    count_prev = await database.Credentials.count_documents({})
-    document = await database.Credentials.find_one(criteria)
-    result = await database.Credentials.delete_one(criteria)
-    if result:
-        count_now = await database.Credentials.count_documents({})
-        _diff = count_prev - count_now
-        _message = "document" if _diff == 1 else "documents"
-        logger.info(f"{_diff} {_message} deleted from Credentials.")
-        if _diff == 1:
-            return document
-        return None
-    return None
+def _item_result(index, identifier, document_id, error=None,
+                 status="created"):
+    result = {"index": index, identifier: document_id, "status": status}
+    if error is not None:
+        result["status"] = "conflict" if error.get("code") == 11000 \
+            else "error"
+        result["error"] = error.get("errmsg")
+    return result
 
 
-async def delete_contact_form(criteria):
-    count_prev = await database.ContactUs.count_documents({})
-    document = await database.ContactUs.find_one(criteria)
-    result = await database.ContactUs.delete_one(criteria)
-    if result:
-        count_now = await database.ContactUs.count_documents({})
-        _diff = count_prev - count_now
-        _message = "document" if _diff == 1 else "documents"
-        logger.info(f"{_diff} {_message} deleted from ContactUs.")
-        if _diff == 1:
-            return document
-        return None
-    return None
+async def bulk_insert(collection, documents, session=None):
+    # Unordered: one bad document does not stop the rest of the batch.
+    identifier = ID_FIELDS[collection]
+    errors = dict()
+    if documents:
+        try:
+            await database[collection].insert_many(
+                documents, ordered=False, session=session)
+        except BulkWriteError as e:
+            errors = {error["index"]: error
+                      for error in e.details.get("writeErrors", [])}
+    return [_item_result(index, identifier, document.get(identifier),
+                         errors.get(index))
+            for index, document in enumerate(documents)]
+
+
+async def existing_ids(collection, ids):
+    identifier = ID_FIELDS[collection]
+    cursor = database[collection].find({identifier: {"$in": list(ids)}},
+                                       {identifier: 1, "_id": 0})
+    return {doc.get(identifier) async for doc in cursor}
+
+
+async def bulk_update(collection, changes):
+    # `changes` is a list of (ID, fields) pairs, applied in one unordered
+    # bulk_write after a single lookup of which IDs exist. Items that
+    # carry a Version are conditional and go through update_document one
+    # by one instead, so a stale version is reported per item.
+    identifier = ID_FIELDS[collection]
+    found = await existing_ids(collection, [_id for _id, _ in changes])
+    operations, positions, conditional = list(), list(), list()
+    for index, (document_id, fields) in enumerate(changes):
+        if document_id not in found:
+            continue
+        if fields.get("Version") is not None:
+            conditional.append((index, document_id, fields))
+            continue
+        update = {"$inc": {"Version": 1}}
+        fields = {k: v for k, v in fields.items() if k not in MANAGED_FIELDS}
+        if fields:
+            update["$set"] = fields
+        operations.append(UpdateOne({identifier: document_id}, update))
+        positions.append(index)
+    errors = dict()
+    if operations:
+        try:
+            await database[collection].bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = {positions[error["index"]]: error
+                      for error in e.details.get("writeErrors", [])}
+
+    stale = set()
+
+    async def _update(index, document_id, fields):
+        try:
+            if not await update_document(collection,
+                                         {identifier: document_id},
+                                         fields, fields["Version"]):
+                stale.add(index)
+        except OperationFailure as e:
+            errors[index] = {"code": e.code, "errmsg": str(e)}
+    await asyncio.gather(*[_update(*item) for item in conditional])
+    results = [_item_result(index, identifier, document_id, errors.get(index),
+                            "updated" if document_id in found
+                            else "not_found")
+               for index, (document_id, _) in enumerate(changes)]
+    for index in stale:
+        results[index].update(status="conflict", error="Modified by another "
+                              "request. Reload and try again")
+    return results
+
+
+async def bulk_delete(collection, ids, session=None):
+    identifier = ID_FIELDS[collection]
+    found = await existing_ids(collection, ids)
+    if found:
+        await database[collection].delete_many(
+            {identifier: {"$in": list(found)}}, session=session)
+    return [_item_result(index, identifier, document_id,
+                         status="deleted" if document_id in found
+                         else "not_found")
+            for index, document_id in enumerate(ids)]
+
+
+async def bulk_create_events(events):
+    results = await bulk_insert("Events", events)
+    event_cache.clear()
+    notify_event_change(None)
+    return results
+
+
+async def bulk_update_events(changes):
+    results = await bulk_update("Events", changes)
+    event_cache.clear()
+    notify_event_change(None)
+    return results
+
+
+async def bulk_delete_events(ids):
+    results = await bulk_delete("Events", ids)
+    event_cache.clear()
+    notify_event_change(None)
+    return results
+
+
+async def bulk_create_users(users, credentials):
+    results = await bulk_insert("Users", users)
+    created = [index for index, result in enumerate(results)
+               if result["status"] == "created"]
+    login_results = await bulk_insert(
+        "Credentials", [credentials[index] for index in created])
+    # A credential that could not be stored leaves its user unusable, so
+    # that user is removed again and reported with the credential error.
+    failed = [(index, login) for index, login in zip(created, login_results)
+              if login["status"] != "created"]
+    if failed:
+        await database.Users.delete_many({"UserID": {"$in": [
+            users[index].get("UserID") for index, _ in failed]}})
+        for index, login in failed:
+            results[index].update(status=login["status"],
+                                  error=login.get("error"))
+    return results
+
 
+async def bulk_update_users(changes):
+    changes = [(document_id, {k: v for k, v in fields.items()
+                              if k not in PROTECTED_USER_FIELDS})
+               for document_id, fields in changes]
+    results = await bulk_update("Users", changes)
+    # New usernames are copied to the credentials, which logins look up,
+    # in one more bulk write.
+    renamed = [index for index, (_, fields) in enumerate(changes)
+               if fields.get("Username")
+               and results[index]["status"] == "updated"]
+    if renamed:
+        try:
+            await database.Credentials.bulk_write([UpdateOne(
+                {"UserID": changes[index][0]},
+                {"$set": {"Username": changes[index][1]["Username"]}}
+            ) for index in renamed], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                index = renamed[error["index"]]
+                logger.error(f"Credential for {changes[index][0]} not "
+                             f"renamed: {error.get('errmsg')}")
+                results[index].update(status="error",
+                                      error=error.get("errmsg"))
+    for document_id, _ in changes:
+        forget_principal(document_id)
+    return results
 
-async def fetch_events():
+
+async def bulk_create_contact_forms(forms):
+    return await bulk_insert("ContactUs", forms)
+
+
+async def bulk_delete_contact_forms(ids):
+    return await bulk_delete("ContactUs", ids)
+
+
+async def bulk_delete_users(ids):
+    async def _delete(session):
+        results = await bulk_delete("Users", ids, session)
+        deleted = [result["UserID"] for result in results
+                   if result["status"] == "deleted"]
+        if deleted:
+            await database.Credentials.delete_many(
+                {"UserID": {"$in": deleted}}, session=session)
+        return results
+    results = await run_in_transaction(_delete)
+    for document_id in ids:
+        forget_principal(document_id)
+    return results
+
+
+async def update_credential(criteria, credential_object):
+    result = await database.Credentials.update_one(
+        criteria, {"$set": credential_object})
+    return result.modified_count == 1
+
+
+# Fields only the server writes: Version by every update, TicketsSold by
+# the purchase path. Client-supplied values for them are ignored.
+MANAGED_FIELDS = ("Version", "TicketsSold")
+# Fields that grant privileges. The user routes are unauthenticated, so
+# these are never taken from them; roles are assigned in the database.
+ROLE_FIELDS = ("IsAdmin", "AccountType")
+# Everything the user routes may not write: the roles, and MyTickets,
+# which only purchase_tickets() changes.
+PROTECTED_USER_FIELDS = ROLE_FIELDS + ("MyTickets",)
+
+
+async def update_document(collection, criteria, fields, version=None,
+                          session=None):
+    # Every write bumps Version; passing the version the caller last read
+    # makes the update conditional on nobody having written since.
+    fields = {k: v for k, v in fields.items() if k not in MANAGED_FIELDS}
+    if version is not None:
+        expected = version if version else {"$in": [0, None]}
+        criteria = {**criteria, "Version": expected}
+    update = {"$inc": {"Version": 1}}
+    if fields:
+        update["$set"] = fields
+    return await database[collection].find_one_and_update(
+        criteria, update,
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+
+async def update_user(criteria, user_object, version=None):
+    user_object = {k: v for k, v in user_object.items()
+                   if k not in PROTECTED_USER_FIELDS}
+
+    username = user_object.get("Username")
+
+    # A new Username is copied to the credential, which logins look up.
+    async def _rename(session):
+        document = await update_document("Users", criteria, user_object,
+                                         version, session)
+        if document:
+            await database.Credentials.update_one(
+                {"UserID": document.get("UserID")},
+                {"$set": {"Username": username}}, session=session)
+        return document
+    if not username:
+        document = await update_document("Users", criteria, user_object,
+                                         version)
+    else:
+        # PUT always carries Username, and it rarely changes. This update
+        # only matches a user who keeps the name, and so needs neither the
+        # transaction nor the credential write.
+        document = await update_document(
+            "Users", {"$and": [criteria, {"Username": username}]},
+            user_object, version)
+        if document is None:
+            document = await run_in_transaction(_rename)
+    if document:
+        forget_principal(document.get("UserID"))
+    return document
+
+
+async def fetch_cart(user_id):
+    return await database.Users.find_one({"UserID": user_id},
+                                         {"_id": 0, "UserID": 1, "InCart": 1})
+
+
+# The cart as stored, with a missing or null InCart read as empty.
+CART = {"$ifNull": ["$InCart", []]}
+
+
+async def update_cart(user_id, in_cart):
+    # Cart changes are single-document pipeline updates computing the new
+    # InCart from the stored one, so concurrent tabs cannot overwrite each
+    # other's additions or removals.
+    doc = await database.Users.find_one_and_update(
+        {"UserID": user_id},
+        [{"$set": {"InCart": in_cart,
+                   "Version": {"$add": [{"$ifNull": ["$Version", 0]}, 1]}}}],
+        projection={"_id": 0, "UserID": 1, "InCart": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if doc:
+        forget_principal(user_id)
+    return doc
+
+
+async def add_to_cart(user_id, event_ids):
+    return await update_cart(
+        user_id, {"$setUnion": [CART, {"$literal": event_ids}]})
+
+
+async def remove_from_cart(user_id, event_id):
+    return await update_cart(user_id, {"$filter": {
+        "input": CART, "as": "item",
+        "cond": {"$ne": ["$$item", {"$literal": event_id}]}}})
+
+
+async def clear_cart(user_id):
+    return await update_cart(user_id, {"$literal": []})
+
+
+async def delete_user(criteria, session=None):
+    document = await delete_document("Users", criteria, session)
+    if document:
+        forget_principal(document.get("UserID"))
+    return document
+
+
+async def delete_credential(criteria, session=None):
+    return await delete_document("Credentials", criteria, session)
+
+
+async def delete_contact_form(criteria, session=None):
+    return await delete_document("ContactUs", criteria, session)
+
+
+async def fetch_events(query=None):
+    if not query:
+        cached = event_cache.get(("all",))
+        if cached is not None:
+            return list(cached)
+    # A write during the scan may be missing from it, so it is not cached.
+    # A secondary may not have the write that emptied the cache yet, so
+    # the scan that refills it reads the primary.
+    version = event_cache.version(("all",))
     events = list()
-    cursor = database.Events.find({})
+    source = catalog if query else database
+    cursor = source.Events.find(query or {}, projection("Events"))
     async for doc in cursor:
-        events.append(models.Events(**doc).dict(by_alias=True))
-    return events
+        events.append(shape("Events", doc))
+    if not query and event_cache.version(("all",)) == version:
+        event_cache.set(("all",), events)
+    return list(events)
 
 
-async def fetch_contact_forms():
+async def fetch_contact_forms(query=None):
     forms = list()
-    cursor = database.ContactUs.find({})
+    cursor = database.ContactUs.find(query or {}, projection("ContactUs"))
     async for doc in cursor:
-        forms.append(models.ContactUs(**doc).dict(by_alias=True))
+        forms.append(shape("ContactUs", doc))
     return forms
 
 
-async def fetch_tickets():
+async def fetch_tickets(query=None):
     tickets = list()
-    cursor = database.Tickets.find({})
+    cursor = database.Tickets.find(query or {}, projection("Tickets"))
     async for doc in cursor:
-        tickets.append(models.Tickets(**doc).dict(by_alias=True))
+        tickets.append(shape("Tickets", doc))
     return tickets
 
 
 async def create_event(event_object):
     result = await database.Events.insert_one(event_object)
+    event_cache.clear()
     if result:
+        notify_event_change(event_object.get("EventID"), event_object)
         return event_object
     return None
 
 
+def is_transient(error):
+    # Failures that may succeed when retried unchanged: lost connections,
+    # elections, timeouts and write concern errors.
+    if isinstance(error, (ConnectionFailure, ExecutionTimeout,
+                          WriteConcernError)):
+        return True
+    if isinstance(error, BulkWriteError):
+        return bool(error.details.get("writeConcernErrors"))
+    return isinstance(error, PyMongoError) and (
+        error.has_error_label("RetryableWriteError")
+        or error.has_error_label("TransientTransactionError"))
+
+
+async def insert_contact_forms(forms):
+    # Write-behind flush; returns the forms that can never be written,
+    # such as ones failing validation or too large to store. Duplicate
+    # FormIDs are skipped: a retried batch finds the forms it wrote the
+    # first time. Transient failures raise, and the batch is retried.
+    try:
+        await database.ContactUs.insert_many(forms, ordered=False)
+    except BulkWriteError as e:
+        if is_transient(e):
+            raise
+        errors = e.details.get("writeErrors", [])
+        rejected = [error for error in errors if error.get("code") != 11000]
+        if len(errors) > len(rejected):
+            logger.error(f"{len(errors) - len(rejected)} of {len(forms)} "
+                         f"contact forms rejected as duplicates")
+        for error in rejected:
+            logger.error(f"Contact form {forms[error['index']].get('FormID')}"
+                         f" rejected: {error.get('errmsg')}")
+        return [forms[error["index"]] for error in rejected]
+    except InvalidDocument as e:
+        # The driver stops at the first form it cannot encode, so the
+        # forms are written one by one to find every bad one.
+        if len(forms) == 1:
+            logger.error(f"Contact form {forms[0].get('FormID')} "
+                         f"rejected: {e}")
+            return forms
+        rejected = list()
+        for form in forms:
+            rejected.extend(await insert_contact_forms([form]))
+        return rejected
+    return []
+
+
 async def create_contact_form(form_object):
     result = await database.ContactUs.insert_one(form_object)
     if result:
@@ -167,7 +988,19 @@ async def fetch_event(prop, by_id=True):
     query = {"EventID": prop}
     if not by_id:
         query = {"EventName": prop}
+    key = ("id" if by_id else "name", prop)
+    cached = event_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+    # Only the key looked up has a version from before the read, so the
+    # document is not also cached under its other key. The read goes to
+    # the primary, like every read that fills the cache.
+    version = event_cache.version(key)
     doc = await database.Events.find_one(query)
+    if doc and event_cache.version(key) == version:
+        event_cache.set(key, doc)
+    if doc:
+        return dict(doc)
     return doc
 
 
@@ -179,24 +1012,216 @@ async def fetch_contact_form(prop):
     return doc
 
 
-async def delete_event(criteria):
-    count_prev = await database.Events.count_documents({})
-    document = await database.Events.find_one(criteria)
-    result = await database.Events.delete_one(criteria)
-    if result:
-        count_now = await database.Events.count_documents({})
-        _diff = count_prev - count_now
-        _message = "document" if _diff == 1 else "documents"
-        logger.info(f"{_diff} {_message} deleted from Events.")
-        if _diff == 1:
-            return document
+async def delete_event(criteria, session=None):
+    document = await delete_document("Events", criteria, session)
+    event_cache.clear()
+    if document:
+        notify_event_change(document.get("EventID"))
+    return document
+
+
+async def update_event(criteria, event_object, version=None):
+    document = await update_document("Events", criteria, event_object,
+                                     version)
+    event_cache.clear()
+    if document:
+        notify_event_change(document.get("EventID"), document)
+    return document
+
+
+def _capacity_allows(quantity):
+    # Events without a Capacity are not inventory-limited.
+    return {"$or": [
+        {"Capacity": None},
+        {"$expr": {"$lte": [
+            {"$add": [{"$ifNull": ["$TicketsSold", 0]}, quantity]},
+            "$Capacity"
+        ]}},
+    ]}
+
+
+async def reserve_tickets(event_id, quantity):
+    # The capacity check and the increment are a single find-and-modify
+    # on the event document, so concurrent buyers cannot oversell it.
+    # Sales leave the event cache alone: at on-sale time evictions would
+    # turn nearly every catalog read into a miss. Cached TicketsSold
+    # counts catch up when their entries expire, as the feed's do.
+    event = await database.Events.find_one_and_update(
+        {"EventID": event_id, **_capacity_allows(quantity)},
+        {"$inc": {"TicketsSold": quantity}},
+        projection={"_id": 0, "EventID": 1, "EventName": 1, "Capacity": 1,
+                    "TicketsSold": 1, "Price": 1, "GenreID": 1,
+                    "EventDate": 1}
+    )
+    if event:
+        event["TicketsSold"] = (event.get("TicketsSold") or 0) + quantity
+    return event
+
+
+async def release_tickets(event, quantity):
+    await database.Events.update_one({"EventID": event.get("EventID")},
+                                     {"$inc": {"TicketsSold": -quantity}})
+    logger.info(f"Released {quantity} tickets for {event.get('EventID')}")
+
+
+async def purchase_tickets(event_id, user_id, quantity, payment_method=None):
+    # Returns (event, tickets), or None when the event does not exist or
+    # has fewer than `quantity` tickets left. Inventory is reserved first
+    # and released again if the tickets cannot be issued, so the hot event
+    # document is never held inside a transaction.
+    event = await reserve_tickets(event_id, quantity)
+    if not event:
         return None
-    return None
+    try:
+        numbers = await generate_new_ids("Tickets", quantity)
+        purchased_at = datetime.now(timezone.utc).isoformat()
+        tickets = [{
+            "TicketNumber": number,
+            "EventID": event_id,
+            "UserID": user_id,
+            "PaymentMethod": payment_method,
+            "PurchaseDate": purchased_at,
+            "Price": event.get("Price"),
+        } for number in numbers]
 
+        async def _issue(session):
+            await database.Tickets.insert_many(tickets, session=session)
+            try:
+                result = await database.Users.update_one(
+                    {"UserID": user_id},
+                    {"$push": {"MyTickets": {"$each": numbers}},
+                     "$inc": {"Version": 1}},
+                    session=session
+                )
+                if not result.matched_count:
+                    raise LookupError(f"User {user_id} not found")
+            except (PyMongoError, LookupError):
+                # Without a transaction, undo the ticket insert by hand.
+                if session is None:
+                    await database.Tickets.delete_many(
+                        {"TicketNumber": {"$in": numbers}})
+                raise
+        await run_in_transaction(_issue)
+    except BaseException:
+        await release_tickets(event, quantity)
+        raise
+    forget_principal(user_id)
+    await record_sale(event, quantity, purchased_at)
+    logger.info(f"{quantity} tickets for {event_id} issued to {user_id}")
+    return event, [shape("Tickets", ticket) for ticket in tickets]
 
-async def update_event(criteria, event_object):
-    result = await database.Events.update_one(criteria, {"$set": event_object})
-    if result:
-        document = await database.Events.find_one(criteria)
-        return document
-    return None
+
+# SalesRollups holds running totals per event, per genre and per day of
+# sale, as {_id: "<kind>|<key>", Kind, Key, Tickets, Revenue, ...}.
+# Purchases add to them as they happen; rebuild_rollups() recomputes them
+# from Tickets joined with Events.
+ROLLUP_KINDS = ("event", "genre", "day")
+
+
+def _price(value):
+    # Same as the $convert to double in rebuild_rollups().
+    if isinstance(value, Decimal128):
+        value = value.to_decimal()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def record_sale(event, quantity, purchased_at):
+    revenue = _price(event.get("Price")) * quantity
+    keys = [
+        ("event", event.get("EventID"), {
+            "EventName": event.get("EventName"),
+            "GenreID": event.get("GenreID"),
+            "EventDate": event.get("EventDate"),
+        }),
+        ("genre", event.get("GenreID"), {}),
+        ("day", purchased_at[:10], {}),
+    ]
+    operations = [UpdateOne(
+        {"_id": f"{kind}|{key}"},
+        {"$inc": {"Tickets": quantity, "Revenue": revenue},
+         "$set": {"Kind": kind, "Key": key, **fields}},
+        upsert=True
+    ) for kind, key, fields in keys]
+    try:
+        await database.SalesRollups.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # The tickets are already issued, so nothing here may fail the
+        # sale; rebuild_rollups() repairs the totals.
+        logger.error(f"Sales rollups not updated for "
+                     f"{event.get('EventID')}: {e}")
+
+
+def _rollup_pipeline(kind, key, fields, rebuilt_at):
+    # Tickets joined with their event; the price stored on the ticket at
+    # sale time wins over the event's current one.
+    price = {"$ifNull": ["$Price", "$event.Price"]}
+    return [
+        {"$lookup": {"from": "Events", "localField": "EventID",
+                     "foreignField": "EventID", "as": "event"}},
+        {"$unwind": {"path": "$event", "preserveNullAndEmptyArrays": True}},
+        {"$group": {
+            "_id": key,
+            "Tickets": {"$sum": 1},
+            "Revenue": {"$sum": {"$convert": {
+                "input": price, "to": "double", "onError": 0, "onNull": 0}}},
+            **{field: {"$first": value} for field, value in fields.items()},
+        }},
+        {"$project": {
+            # Same _id as record_sale() gives, including for a None key.
+            "_id": {"$concat": [f"{kind}|", {"$ifNull": [
+                {"$toString": "$_id"}, "None"]}]},
+            "Kind": {"$literal": kind},
+            "Key": "$_id",
+            "Tickets": 1,
+            "Revenue": 1,
+            "RebuiltAt": {"$literal": rebuilt_at},
+            **{field: 1 for field in fields},
+        }},
+        {"$merge": {"into": "SalesRollups", "on": "_id",
+                    "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+async def rebuild_rollups():
+    # Recomputes every rollup server-side; sales made while it runs may
+    # be counted twice or not at all, so run it when sales are quiet.
+    now = datetime.now(timezone.utc)
+    # BSON dates keep milliseconds, and this value is matched below.
+    rebuilt_at = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    pipelines = {
+        "event": _rollup_pipeline("event", "$EventID", {
+            "EventName": "$event.EventName",
+            "GenreID": "$event.GenreID",
+            "EventDate": "$event.EventDate",
+        }, rebuilt_at),
+        "genre": _rollup_pipeline("genre", "$event.GenreID", {},
+                                  rebuilt_at),
+        "day": _rollup_pipeline("day", {"$substrCP": [
+            {"$toString": "$PurchaseDate"}, 0, 10]}, {}, rebuilt_at),
+    }
+    for kind, pipeline in pipelines.items():
+        await database.Tickets.aggregate(pipeline).to_list(None)
+    result = await database.SalesRollups.delete_many(
+        {"RebuiltAt": {"$ne": rebuilt_at}})
+    counts = {kind: await database.SalesRollups.count_documents(
+        {"Kind": kind}) for kind in ROLLUP_KINDS}
+    logger.info(f"Sales rollups rebuilt: {counts}, "
+                f"{result.deleted_count} stale removed")
+    return counts
+
+
+async def fetch_rollups(kind, query=None, sort=None, limit=None):
+    cursor = database.SalesRollups.find(
+        {"Kind": kind, **(query or {})},
+        {"_id": 0, "Kind": 0, "RebuiltAt": 0}
+    ).sort(sort or [("Key", 1)])
+    if limit:
+        cursor = cursor.limit(limit)
+    rollups = list()
+    async for doc in cursor:
+        doc["Revenue"] = round(doc.get("Revenue") or 0, 2)
+        rollups.append(doc)
+    return rollups
@@ -0,0 +1,97 @@
+from pymongo import monitoring
+from constants import SLOW_QUERY_MS
+import logging
+
+logger = logging.getLogger("database")
+
+# Every lookup shape the API issues, as (collection, filter, sort).
+QUERY_SHAPES = [
+    ("Users", {"UserID": "1"}, None),
+    ("Users", {"Username": "username"}, None),
+    ("Users", {"Email": "email"}, None),
+    ("Users", {}, [("UserID", 1), ("_id", 1)]),
+    ("Credentials", {"Username": "username"}, None),
+    ("Credentials", {"UserID": "1"}, None),
+    ("Events", {"EventID": "A1"}, None),
+    ("Events", {"EventName": "name"}, None),
+    ("Events", {}, [("EventID", 1), ("_id", 1)]),
+    ("Events", {"GenreID": "1", "EventDate": {"$gte": "2026-01-01"}},
+     [("EventDate", 1), ("_id", 1)]),
+    ("Events", {"Genres": "Rock"}, [("EventDate", 1), ("_id", 1)]),
+    ("Events", {"EventType": "Concert"}, [("EventDate", 1), ("_id", 1)]),
+    ("Events", {"Venue": "venue"}, [("EventDate", 1), ("_id", 1)]),
+    ("Events", {"Artists": "artist"}, [("EventDate", 1), ("_id", 1)]),
+    ("Events", {"IsHero": True}, [("EventDate", 1), ("_id", 1)]),
+    ("Events", {"$text": {"$search": "jazz"}}, [("EventDate", 1), ("_id", 1)]),
+    ("ContactUs", {"FormID": "1"}, None),
+    ("ContactUs", {}, [("FormID", 1), ("_id", 1)]),
+    ("Tickets", {"EventID": "A1"}, None),
+    ("Tickets", {"UserID": "1"}, None),
+    ("Tickets", {}, [("TicketNumber", 1), ("_id", 1)]),
+]
+
+
+def plan_stages(plan):
+    stages = list()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key in ("queryPlan", "inputStage"):
+            stages.extend(plan_stages(plan.get(key)))
+        for child in plan.get("inputStages", []):
+            stages.extend(plan_stages(child))
+    return stages
+
+
+async def explain(database, collection, query, sort=None):
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    result = await database.command("explain", command,
+                                    verbosity="executionStats")
+    stages = plan_stages(result.get("queryPlanner", {}).get("winningPlan"))
+    millis = result.get("executionStats", {}).get("executionTimeMillis", 0)
+    return {
+        "collection": collection,
+        "filter": query,
+        "sort": sort,
+        "stages": stages,
+        "millis": millis,
+        "collscan": "COLLSCAN" in stages,
+        "slow": millis >= SLOW_QUERY_MS,
+    }
+
+
+async def audit_query_plans(database):
+    report = list()
+    for collection, query, sort in QUERY_SHAPES:
+        result = await explain(database, collection, query, sort)
+        shape = f"{collection} {list(query) or sort}"
+        if result["collscan"]:
+            logger.warning(f"Collection scan: {shape}: {result['stages']}")
+        if result["slow"]:
+            logger.warning(f"Slow query: {shape}: {result['millis']} ms")
+        report.append(result)
+    logger.info(f"Audited {len(report)} query shapes")
+    return report
+
+
+class SlowCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = dict()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        self._collections[event.request_id] = \
+            target if isinstance(target, str) else None
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, None)
+        millis = event.duration_micros / 1000
+        if millis >= SLOW_QUERY_MS:
+            logger.warning(f"Slow command: {event.command_name} on "
+                           f"{event.database_name}.{collection}: "
+                           f"{millis:.1f} ms")
+
+    def failed(self, event):
+        self._collections.pop(event.request_id, None)
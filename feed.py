@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+import database as db
+import conditional
+from constants import FEED_RAIL_SIZE, FEED_REFRESH_SECONDS
+
+logger = logging.getLogger("controller")
+
+# The homepage feed, kept in memory per worker: every event by EventID,
+# and the rendered payload with its ETag. Event writes in this worker
+# patch the events in place; writes made by other workers show up at the
+# next scheduled rescan.
+_events = dict()
+_body = None
+_etag = None
+_dirty = True
+_stale = True
+_generation = 0
+_lock = asyncio.Lock()
+_task = None
+
+
+def _date(event):
+    return str(event.get("EventDate") or "")[:10]
+
+
+def _rail(events):
+    return sorted(events, key=_date)[:FEED_RAIL_SIZE]
+
+
+def build(events, today=None):
+    today = today or date.today()
+    week_end = (today + timedelta(days=7)).isoformat()
+    today = today.isoformat()
+    # Undated events are never "past", so they stay on the rails.
+    upcoming = [event for event in events
+                if not _date(event) or _date(event) >= today]
+    genres = dict()
+    for event in upcoming:
+        for genre in event.get("Genres") or []:
+            genres.setdefault(genre, []).append(event)
+    return {
+        "date": today,
+        "hero": _rail(event for event in upcoming if event.get("IsHero")),
+        "thisWeek": _rail(event for event in upcoming
+                          if today <= _date(event) <= week_end),
+        "genres": {genre: _rail(rail) for genre, rail in sorted(
+            genres.items(), key=lambda item: str(item[0]))},
+    }
+
+
+def apply_change(event_id, document):
+    # database.on_event_change callback.
+    global _dirty, _stale, _generation
+    _generation += 1
+    if event_id is None:
+        _stale = True
+    elif document is None:
+        _events.pop(event_id, None)
+    else:
+        _events[event_id] = db.shape("Events", document)
+    _dirty = True
+
+
+async def rebuild():
+    global _events, _dirty, _stale
+    async with _lock:
+        if not _stale:
+            return
+        generation = _generation
+        events = await db.fetch_events()
+        _events = {event.get("EventID"): event for event in events}
+        # A change that landed mid-scan may be missing from it.
+        _stale = _generation != generation
+        _dirty = True
+        logger.info(f"Feed rebuilt from {len(_events)} events")
+
+
+def render():
+    global _body, _etag, _dirty
+    _dirty = False
+    _body, _etag = conditional.render(build(_events.values()))
+
+
+async def current():
+    # Returns the serialized feed and its ETag, rendering at most once
+    # per burst of changes.
+    if _stale:
+        await rebuild()
+    if _dirty:
+        render()
+    return _body, _etag
+
+
+async def _refresh_periodically():
+    global _stale
+    while True:
+        await asyncio.sleep(FEED_REFRESH_SECONDS)
+        _stale = True
+        try:
+            await rebuild()
+            render()
+        except Exception as e:
+            logger.error(f"Feed refresh failed: {e}")
+
+
+def start():
+    global _task
+    if apply_change not in db.event_listeners:
+        db.on_event_change(apply_change)
+    _task = asyncio.get_running_loop().create_task(_refresh_periodically())
+
+
+def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
@@ -0,0 +1,149 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from constants import RATE_LIMITS, LIMITER_BACKEND, LIMITER_MAX_KEYS
+from constants import ADMISSION_CONCURRENCY
+import metrics
+
+logger = logging.getLogger("controller")
+
+rate_limited = metrics.Counter(
+    "rate_limited_total", "Requests rejected by a rate limit.",
+    ("route", "scope"))
+admission_rejected = metrics.Counter(
+    "admission_rejected_total", "Requests shed by the concurrency cap.",
+    ("route",))
+
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Overloaded(RateLimited):
+    pass
+
+
+def parse_rule(rule):
+    # "10/60" is 10 requests per 60 seconds.
+    limit, period = rule.split("/")
+    return int(limit), float(period)
+
+
+class MemoryBackend:
+    # Token buckets in this process: `limit` tokens, refilled at
+    # limit/period per second. With several workers every worker has its
+    # own buckets, so the effective limit scales with WEB_CONCURRENCY.
+
+    def __init__(self, max_keys=LIMITER_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    async def take(self, key, limit, period):
+        # Returns 0 when a token was taken, otherwise the seconds until
+        # the next one.
+        now = time.monotonic()
+        rate = limit / period
+        tokens, updated = self.buckets.pop(key, (limit, now))
+        tokens = min(limit, tokens + (now - updated) * rate)
+        retry_after = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        # The least recently used keys are the idle ones, whose buckets
+        # have refilled anyway.
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+
+class MongoBackend:
+    # Fixed-window counters in a MongoDB collection, shared by every
+    # worker and instance. Windows expire through a TTL index.
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, key, limit, period):
+        now = time.time()
+        window = int(now // period)
+        window_end = (window + 1) * period
+        try:
+            doc = await self.collection.find_one_and_update(
+                {"_id": f"{key}|{window}"},
+                {"$inc": {"count": 1},
+                 "$setOnInsert": {"expireAt": datetime.fromtimestamp(
+                     window_end, timezone.utc)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as e:
+            # Fail open: an unreachable limiter must not take logins down.
+            logger.error(f"Rate limit backend failed: {e}")
+            return 0
+        if doc.get("count", 0) <= limit:
+            return 0
+        return window_end - now
+
+
+backend = MemoryBackend()
+_active = 0
+
+
+def configure(database=None):
+    global backend
+    if LIMITER_BACKEND == "mongo" and database is not None:
+        backend = MongoBackend(database.RateLimits)
+    else:
+        backend = MemoryBackend()
+    logger.info(f"Rate limits use the {type(backend).__name__}")
+
+
+async def check(route, **keys):
+    # keys are scope=value pairs, e.g. ip="10.0.0.1", username="alice";
+    # each scope with a rule for this route takes one token.
+    rules = RATE_LIMITS.get(route) or {}
+    for scope, value in keys.items():
+        rule = rules.get(scope)
+        if not rule or value is None:
+            continue
+        limit, period = parse_rule(rule)
+        key = f"{route}|{scope}|{str(value).lower()}"
+        retry_after = await backend.take(key, limit, period)
+        if retry_after:
+            rate_limited.inc(route, scope)
+            raise RateLimited("Too many requests, try again later.",
+                              math.ceil(retry_after))
+
+
+class Slot:
+    def __init__(self):
+        self.released = False
+
+    def release(self):
+        global _active
+        if not self.released:
+            self.released = True
+            _active -= 1
+
+
+def acquire(route):
+    # One cap shared by every bcrypt-heavy route in this worker. Requests
+    # over it are shed at once instead of queueing behind the pool.
+    global _active
+    if _active >= ADMISSION_CONCURRENCY:
+        admission_rejected.inc(route)
+        raise Overloaded("Server busy, try again shortly.", 1)
+    _active += 1
+    return Slot()
+
+
+metrics.CallbackGauge("admission_active", "Requests holding a slot under "
+                      "the concurrency cap.", (), lambda: {(): _active})
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from collections import deque
+from pymongo.errors import OperationFailure, PyMongoError
+import database as db
+from constants import LIVE_COLLECTIONS, LIVE_BUFFER_SIZE
+from constants import LIVE_SUBSCRIBER_QUEUE, LIVE_HEARTBEAT_SECONDS
+from responses import FastJSONResponse
+
+logger = logging.getLogger("controller")
+
+# One change stream per worker, fanned out to every subscriber in that
+# worker. Changes are numbered by their resume token, which is the same
+# in every worker, so a client may reconnect to any of them with
+# Last-Event-ID and get what it missed from the ring buffer.
+_buffer = deque(maxlen=LIVE_BUFFER_SIZE)
+_subscribers = set()
+_event_keys = dict()
+_resume_token = None
+_task = None
+available = False
+
+OPERATIONS = ["insert", "update", "replace", "delete"]
+# ChangeStreamFatalError and ChangeStreamHistoryLost: the resume token
+# points before the oldest oplog entry, so resuming from it never works.
+HISTORY_LOST = (280, 286)
+# Collection -> fields a change message carries. Tickets only announce
+# which event sold, not who bought.
+MESSAGE_FIELDS = {
+    "Events": None,
+    "Tickets": ["TicketNumber", "EventID"],
+}
+
+
+def pipeline():
+    return [{"$match": {
+        "ns.coll": {"$in": list(LIVE_COLLECTIONS)},
+        "operationType": {"$in": OPERATIONS},
+    }}]
+
+
+def watch(resume_after=None):
+    return db.database.watch(pipeline(), full_document="updateLookup",
+                             resume_after=resume_after)
+
+
+def message(change):
+    collection = change["ns"]["coll"]
+    object_id = change["documentKey"]["_id"]
+    document = change.get("fullDocument")
+    if collection == "Events":
+        if document:
+            _event_keys[object_id] = document.get("EventID")
+        key = _event_keys.get(object_id)
+        if change["operationType"] == "delete":
+            _event_keys.pop(object_id, None)
+    else:
+        key = document.get(db.ID_FIELDS[collection]) if document else None
+    if document is not None:
+        fields = MESSAGE_FIELDS.get(collection) or db.FIELDS[collection]
+        document = {field: document.get(field) for field in fields}
+    return {
+        "collection": collection,
+        "operation": change["operationType"],
+        "id": key,
+        "document": document,
+    }
+
+
+def frame(token, data, event="change"):
+    return f"id: {token}\nevent: {event}\ndata: ".encode() + data + b"\n\n"
+
+
+def publish(change):
+    token = change["_id"]["_data"]
+    data = FastJSONResponse(content=message(change)).body
+    _buffer.append((token, data))
+    for queue in list(_subscribers):
+        try:
+            queue.put_nowait((token, data))
+        except asyncio.QueueFull:
+            # A subscriber this far behind is cut off; it reconnects with
+            # Last-Event-ID and catches up from the buffer instead.
+            close(queue)
+
+
+def close(queue):
+    # Drops what the subscriber has not read yet and ends its stream.
+    _subscribers.discard(queue)
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+async def _load_event_keys():
+    # Deletes only carry the _id, so the EventID is looked up from here.
+    cursor = db.database.Events.find({}, {"EventID": 1})
+    async for doc in cursor:
+        _event_keys[doc["_id"]] = doc.get("EventID")
+
+
+async def consume(source=watch):
+    # `source(resume_after)` returns the change stream; tests and the
+    # benchmarks pass a stand-in for it.
+    global _resume_token, available
+    delay = 1
+    while True:
+        try:
+            async with source(_resume_token) as stream:
+                available = True
+                delay = 1
+                logger.info(f"Watching {', '.join(LIVE_COLLECTIONS)}")
+                async for change in stream:
+                    publish(change)
+                    _resume_token = change["_id"]
+        except OperationFailure as e:
+            if e.code == 40573:
+                available = False
+                logger.error("Live updates need a replica set or sharded "
+                             "cluster; change streams are unavailable.")
+                return
+            if e.code in HISTORY_LOST:
+                # Start again from now. Everyone is disconnected; their
+                # Last-Event-ID is no longer buffered, so they reconnect
+                # to a reset and reload.
+                logger.error(f"Change stream history lost, restarting "
+                             f"from now: {e}")
+                _resume_token = None
+                _buffer.clear()
+                for queue in list(_subscribers):
+                    close(queue)
+                continue
+            logger.error(f"Change stream failed: {e}")
+        except PyMongoError as e:
+            logger.error(f"Change stream failed: {e}")
+        except Exception as e:
+            available = False
+            logger.error(f"Change stream consumer stopped: {e!r}")
+            return
+        available = False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+def subscribe(last_event_id=None):
+    # Returns (queue, backlog). backlog is None when last_event_id is no
+    # longer buffered and the client has to reload instead.
+    queue = asyncio.Queue(maxsize=LIVE_SUBSCRIBER_QUEUE)
+    backlog = list()
+    if last_event_id:
+        tokens = [token for token, _ in _buffer]
+        if last_event_id not in tokens:
+            backlog = None
+        else:
+            backlog = list(_buffer)[tokens.index(last_event_id) + 1:]
+    _subscribers.add(queue)
+    return queue, backlog
+
+
+def unsubscribe(queue):
+    _subscribers.discard(queue)
+
+
+async def stream(queue, backlog):
+    # Server-Sent Events for one subscriber, comments as heartbeats.
+    try:
+        if backlog is None:
+            yield b"event: reset\ndata: {}\n\n"
+        for token, data in backlog or []:
+            yield frame(token, data)
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(),
+                                              LIVE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+            if item is None:
+                return
+            yield frame(*item)
+    finally:
+        unsubscribe(queue)
+
+
+async def start(source=watch):
+    global _task
+    if not LIVE_COLLECTIONS:
+        return
+    if "Events" in LIVE_COLLECTIONS:
+        await _load_event_keys()
+    _task = asyncio.get_running_loop().create_task(consume(source))
+
+
+def stop():
+    global _task, available
+    available = False
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    for queue in list(_subscribers):
+        close(queue)
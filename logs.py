@@ -0,0 +1,150 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from uuid import uuid4
+from constants import LOG_LEVELS, LOG_SAMPLE, LOG_QUEUE_SIZE
+import metrics
+
+request_id = contextvars.ContextVar("request_id", default=None)
+request_path = contextvars.ContextVar("request_path", default=None)
+
+ID_KEYS = ("UserID", "Username", "EventID", "EventName", "FormID",
+           "TicketNumber")
+
+_queues = dict()
+_listeners = dict()
+dropped = 0
+
+
+def parse_setting(setting):
+    # "controller=INFO,database=WARNING" -> {"controller": "INFO", ...}
+    pairs = [item.split("=", 1) for item in setting.split(",") if "=" in item]
+    return {key.strip(): value.strip() for key, value in pairs}
+
+
+LEVELS = parse_setting(LOG_LEVELS)
+SAMPLE_RATES = {path: float(rate)
+                for path, rate in parse_setting(LOG_SAMPLE).items()}
+
+
+metrics.CallbackCounter("log_records_dropped_total",
+                        "Log records dropped because a queue was full.",
+                        (), lambda: {(): dropped})
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "path": getattr(record, "path", None),
+        }
+        return json.dumps(entry, default=str)
+
+
+class ContextFilter(logging.Filter):
+    # Runs in the request's context: stamps the request ID and path and
+    # samples INFO and below on the paths listed in LOG_SAMPLE.
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        record.path = request_path.get()
+        if record.path and record.levelno <= logging.INFO:
+            for prefix, rate in SAMPLE_RATES.items():
+                if record.path.startswith(prefix):
+                    return random.random() < rate
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+def get_logger(name, filename):
+    # Records are queued right away and written by a background listener
+    # once start() runs, so nothing logged at import time is lost.
+    logger = logging.getLogger(name)
+    logger.setLevel(LEVELS.get(name, "INFO"))
+    if name not in _queues:
+        handler = BoundedQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(ContextFilter())
+        logger.addHandler(handler)
+        _queues[name] = (handler, filename)
+    return logger
+
+
+def start():
+    for name, (handler, filename) in _queues.items():
+        if name in _listeners:
+            continue
+        file_handler = logging.FileHandler(filename)
+        file_handler.setFormatter(JSONFormatter())
+        listener = QueueListener(handler.queue, file_handler)
+        listener.start()
+        _listeners[name] = (listener, file_handler)
+
+
+def stop():
+    for listener, file_handler in _listeners.values():
+        listener.stop()
+        file_handler.close()
+    _listeners.clear()
+
+
+def _reset_after_fork():
+    # Listener threads do not survive fork() and an inherited queue may
+    # hold a lock taken mid-put, so the child starts with fresh queues.
+    global dropped
+    for handler, _ in _queues.values():
+        handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listeners.clear()
+    dropped = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def summarize(value, limit=200):
+    if isinstance(value, dict):
+        ids = {key: value[key] for key in ID_KEYS if key in value}
+        return f"{ids} ({len(value)} fields)"
+    text = repr(value)
+    return text if len(text) <= limit else f"{text[:limit]}..."
+
+
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        rid = headers.get(b"x-request-id", b"").decode("latin-1")[:64]
+        rid = rid or uuid4().hex
+        id_token = request_id.set(rid)
+        path_token = request_path.set(scope["path"])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(id_token)
+            request_path.reset(path_token)
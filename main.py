@@ -1,27 +1,41 @@
 from uuid import uuid4
+from typing import List
+from collections import Counter
+from datetime import datetime, timedelta
+import asyncio
 import json
-from fastapi import FastAPI, HTTPException, Depends, Form
+from fastapi import FastAPI, HTTPException, Depends, Form, Query, Body
+from fastapi import Header, Request
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-import bcrypt
 import jwt
+from pymongo.errors import DuplicateKeyError
+import batching
 import database as db
+import diagnostics
+import feed
+import live
+import limiter
+from responses import FastJSONResponse
+from conditional import ConditionalGet, conditional_get, render
 import models
-import logging
+import passwords
+from constants import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, DB_DIAGNOSTICS
+from constants import CATALOG_MAX_AGE, JWT_PROFILE_CLAIMS, MAX_BULK_SIZE
+from constants import MAX_TICKETS_PER_ORDER, TRUSTED_PROXY_HOPS
+from constants import MAX_BULK_USERS
+from constants import CONTACT_WRITE_BEHIND, CONTACT_BATCH_SIZE
+from constants import CONTACT_FLUSH_SECONDS, CONTACT_MAX_PENDING
+from constants import CONTACT_SUBMIT_TIMEOUT, CONTACT_ID_BLOCK
+import logs
+import metrics
 
-logger = logging.getLogger("controller")
-logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler("controller.log")
-logger.addHandler(file_handler)
-formatter = logging.Formatter("%(asctime)s: "
-                              "%(levelname)s: "
-                              "%(name)s: "
-                              "%(message)s")
-file_handler.setFormatter(formatter)
+logger = logs.get_logger("controller", "controller.log")
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 origins = [
     "http://localhost:3000",
@@ -33,6 +47,8 @@ url_match = r"http://localhost:3000/?.*|" \
             r"https?://couchfest.herokuapp.com/?.*|" \
             r"https?://couchtest.herokuapp.com/?.*|"
 
+app.add_middleware(logs.RequestContextMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -42,23 +58,131 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+form_ids = db.IdBlock("ContactUs", CONTACT_ID_BLOCK)
+contact_forms = batching.WriteBehind(
+    "contact_forms", db.insert_contact_forms, CONTACT_BATCH_SIZE,
+    CONTACT_FLUSH_SECONDS, CONTACT_MAX_PENDING, CONTACT_SUBMIT_TIMEOUT)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='/api/token')
 JWT_SECRET = "CouchFestWebToken"
-
-
-@app.post("/api/token")
+# Profile fields copied into tokens when JWT_PROFILE_CLAIMS is set.
+PROFILE_CLAIMS = ("Username", "FirstName", "LastName", "Email",
+                  "AccountType", "IsAdmin")
+
+
+@app.on_event("startup")
+async def startup():
+    logs.start()
+    await db.connect()
+    await db.ensure_indexes()
+    await db.seed_counters()
+    limiter.configure(db.database)
+    if CONTACT_WRITE_BEHIND:
+        contact_forms.start()
+    feed.start()
+    await live.start()
+    if DB_DIAGNOSTICS:
+        await diagnostics.audit_query_plans(db.database)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await contact_forms.stop()
+    passwords.shutdown()
+    feed.stop()
+    live.stop()
+    db.close()
+    logs.stop()
+
+
+async def enforce(route, **keys):
+    try:
+        await limiter.check(route, **keys)
+    except limiter.RateLimited as e:
+        raise HTTPException(429, str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+def client_ip(request):
+    # Only entries appended by our own proxies count; anything left of
+    # them came from the client. Otherwise uvicorn has already applied
+    # X-Forwarded-For from FORWARDED_ALLOW_IPS.
+    if TRUSTED_PROXY_HOPS:
+        hops = [hop.strip() for header in
+                request.headers.getlist("x-forwarded-for")
+                for hop in header.split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else None
+
+
+def rate_limit(route):
+    # Route dependency for the per-IP limit. Per-username limits are
+    # enforced in the route, once the form is parsed.
+    async def dependency(request: Request):
+        await enforce(route, ip=client_ip(request))
+    return dependency
+
+
+def admission(route):
+    # Route dependency: the per-IP limit, then a slot under the cap the
+    # bcrypt-heavy routes share.
+    async def dependency(request: Request):
+        await enforce(route, ip=client_ip(request))
+        try:
+            slot = limiter.acquire(route)
+        except limiter.Overloaded as e:
+            raise HTTPException(503, str(e),
+                                headers={"Retry-After": str(e.retry_after)})
+        try:
+            yield
+        finally:
+            slot.release()
+    return dependency
+
+
+async def run_password_task(task):
+    try:
+        return await task
+    except passwords.PoolBusy as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": "1"})
+
+
+async def check_login(username, password):
+    user_object = await db.fetch_credential(username)
+    if not user_object:
+        return None
+    user_credential = user_object.get("credential")
+    is_valid = await run_password_task(
+        passwords.verify_password(password, user_credential))
+    if not is_valid:
+        return None
+    if passwords.needs_rehash(user_credential):
+        logger.info(f"Rehashing credential for: {username}")
+        _hashed = await run_password_task(passwords.hash_password(password))
+        await db.update_credential({"Username": username},
+                                   {"credential": _hashed})
+    return user_object
+
+
+async def encode_token(claims):
+    if JWT_PROFILE_CLAIMS:
+        user = await db.fetch_user(claims.get("UserID")) or {}
+        claims.update({key: user.get(key) for key in PROFILE_CLAIMS})
+        claims["profile"] = True
+    return jwt.encode(claims, JWT_SECRET)
+
+
+@app.post("/api/token", dependencies=[Depends(admission("/api/token"))])
 async def generate_token(form_data: OAuth2PasswordRequestForm = Depends()):
+    await enforce("/api/token", username=form_data.username)
     logger.info("Generating a token to identify user.")
-    user_object = await db.fetch_credential(form_data.username)
-    form_password = form_data.password
-    user_credential = user_object.get("credential")
-    is_valid = bcrypt.checkpw(form_password.encode(), user_credential.encode())
-    if is_valid:
+    user_object = await check_login(form_data.username, form_data.password)
+    if user_object:
         _object = {
             "UserID": user_object.get("UserID"),
             "Username": user_object.get("Username"),
         }
-        token = jwt.encode(_object, JWT_SECRET)
+        token = await encode_token(_object)
         return {
             "access_token": token,
             "token_type": "bearer"
@@ -69,15 +193,38 @@ async def generate_token(form_data: OAuth2PasswordRequestForm = Depends()):
     }
 
 
-def generate_new_id(objects, identifier, model):
-    logger.info(f"Generating new ID for {model}")
-    if not objects:
-        return "1"
-    all_ids = sorted([i.get(identifier) for i in objects])
-    if model.lower() == "events":
-        all_ids = sorted([i.get(identifier).split("A")[-1] for i in objects])
-        return f"A{str(int(all_ids[-1]) + 1)}"
-    return str(int(all_ids[-1]) + 1)
+def build_query(**filters):
+    return {key: value for key, value in filters.items() if value is not None}
+
+
+async def fetch_page(collection, limit, after, query):
+    try:
+        return await db.fetch_page(collection, limit or DEFAULT_PAGE_SIZE,
+                                   after=after, query=query)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+def conflict_message(label, error):
+    key_value = (error.details or {}).get("keyValue") or {}
+    field, value = next(iter(key_value.items()), ("key", None))
+    field = {"UserID": "ID", "EventID": "ID", "FormID": "ID",
+             "EventName": "event name"}.get(field, field.lower())
+    return f"Conflict: {label} with {field} {value} already exists! Try again"
+
+
+# An update that matched nothing hit either a missing document or, when a
+# Version was sent, a document someone else changed in the meantime.
+def version_conflict(label):
+    return HTTPException(409,
+                         f"Conflict: {label} was modified by another "
+                         f"request. Reload and try again")
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(),
+                             media_type="text/plain; version=0.0.4")
 
 
 @app.get("/api")
@@ -85,7 +232,41 @@ def read_root():
     return JSONResponse(status_code=200, content={"message": "API is working"})
 
 
-@app.post("/api/create_user", response_model=models.Users)
+def new_user(firstname, lastname, username, email):
+    return {
+        "FirstName": firstname,
+        "LastName": lastname,
+        "Username": username,
+        "Email": email,
+        "AccountType": "Normal user",
+        "PaymentType": uuid4().hex,
+        "MyEvents": [],
+        "MyTickets": [],
+        "MyGenres": [],
+        "InCart": [],
+        "IsAdmin": False,
+        "Version": 0,
+    }
+
+
+def check_bulk_size(items, limit=MAX_BULK_SIZE):
+    if not items:
+        raise HTTPException(400, "Bad request: empty batch.")
+    if len(items) > limit:
+        raise HTTPException(413, f"Batch too large: at most {limit} "
+                                 f"items per request.")
+
+
+def bulk_response(results):
+    summary = Counter(result["status"] for result in results)
+    return FastJSONResponse(status_code=200, content={
+        "results": results,
+        "summary": dict(summary),
+    })
+
+
+@app.post("/api/create_user", response_model=models.Users,
+          dependencies=[Depends(admission("/api/create_user"))])
 async def create_user(
         firstname: str = Form(...),
         lastname: str = Form(...),
@@ -93,88 +274,124 @@ async def create_user(
         email: str = Form(...),
         password: str = Form(...)):
 
-    _user = {
-        "FirstName": firstname,
-        "LastName": lastname,
-        "Username": username,
-        "Email": email,
-    }
     logger.info("Creating a new user")
     # _user = user_object.dict(by_alias=True)
-    users = await db.fetch_users()
-    user_id_key = "UserID"
-    new_user_id = generate_new_id(users, user_id_key, "Users")
-    user_id = _user.get(user_id_key)
-    if user_id is None:
-        _user[user_id_key] = new_user_id
-    else:
-        id_response = await db.fetch_user(user_id)
-        if id_response:
-            raise HTTPException(409,
-                                f"Conflict: User with ID {user_id} "
-                                f"already exists! Try again")
-    user_name = _user.get("Username")
-    user_email = _user.get("Email")
-    name_response = await db.fetch_user(user_name, by_id=False)
-    email_response = await db.fetch_user_by_email(user_email)
-    if name_response:
-        raise HTTPException(409,
-                            f"Conflict: User with username {user_name} "
-                            f"already exists! Try again")
-    if email_response:
-        raise HTTPException(409,
-                            f"Conflict: User with email {user_email} "
-                            f"already exists! Try again")
-    else:
-        _user["AccountType"] = "Normal user"
-        _user["PaymentType"] = uuid4().hex
-        _user["MyEvents"] = []
-        _user["MyTickets"] = []
-        _user["MyGenres"] = []
-        _user["InCart"] = []
-        _user["IsAdmin"] = False
-        _hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-        _credential = {
-            "UserID": new_user_id,
-            "Username": username,
-            "credential": _hashed.decode()
-        }
-        create_response = await db.create_user(_user)
-        if create_response:
-            add_login = await db.add_credential(_credential)
-            _created = await db.fetch_user(create_response.get(user_id_key))
-            if _created:
-                _added = await db.fetch_credential(add_login.get("Username"))
-                if _added:
-                    return create_response
-
-            error_message = {"error": "Couldn't create new user"}
-            return error_message
-
-    raise HTTPException(400, f"Bad request.")
+    _user = new_user(firstname, lastname, username, email)
+    # Uniqueness of UserID, Username and Email is enforced by the unique
+    # indexes, so there is nothing to check before the insert.
+    user_id, _hashed = await asyncio.gather(
+        db.generate_new_id("Users"),
+        run_password_task(passwords.hash_password(password))
+    )
+    _user["UserID"] = user_id
+    _credential = {
+        "UserID": user_id,
+        "Username": username,
+        "credential": _hashed
+    }
+    try:
+        return await db.create_user_with_credential(_user, _credential)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("User", e))
 
 
 @app.get("/api/users")
-async def get_users():
+async def get_users(
+        limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: str = None,
+        account_type: str = None,
+        is_admin: bool = None):
     # logger.info("Getting all users")
-    response = await db.fetch_users()
+    query = build_query(AccountType=account_type, IsAdmin=is_admin)
+    if limit is not None or after is not None:
+        page = await fetch_page("Users", limit, after, query)
+        return FastJSONResponse(status_code=200, content=page)
+    response = await db.fetch_users(query)
     if response:
-        return JSONResponse(status_code=200, content=response)
+        return FastJSONResponse(status_code=200, content=response)
     raise HTTPException(404, f"Users not found here.")
 
 
+def decode_token(token):
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid Credentials")
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    payload = decode_token(token)
     # user = db.query(_models.User).get(payload["id"])
     # response = await db.fetch_user(payload.get("Username"), by_id=False)
     logger.info("Getting currently logged in user.")
-    response = await db.fetch_user(payload.get("UserID"))
-    logger.info(response)
+    response = await db.fetch_principal(payload.get("UserID"), token)
     if response:
+        logger.info(f"Current user: {response.get('UserID')}")
         return response
     raise HTTPException(status_code=401, detail="Invalid Credentials")
 
 
+async def get_current_admin(user=Depends(get_current_user)):
+    if not user.get("IsAdmin"):
+        raise HTTPException(403, "Forbidden: admins only.")
+    return user
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)):
+    # For routes that only need who the caller is: tokens issued with
+    # profile claims are trusted as-is and skip the user lookup. Claims
+    # are fixed at login, so routes that need live data (cart, tickets)
+    # should depend on get_current_user instead.
+    payload = decode_token(token)
+    if payload.get("profile"):
+        return {key: payload.get(key) for key in ("UserID",) + PROFILE_CLAIMS}
+    return await get_current_user(token)
+
+
+@app.post("/api/users/bulk",
+          dependencies=[Depends(get_current_admin),
+                        Depends(admission("/api/users/bulk"))])
+async def create_users_bulk(registrations: List[models.UserRegistration]):
+    check_bulk_size(registrations, MAX_BULK_USERS)
+    logger.info(f"Bulk creating {len(registrations)} users")
+    user_ids, hashes = await asyncio.gather(
+        db.generate_new_ids("Users", len(registrations)),
+        run_password_task(passwords.hash_many(
+            [registration.password for registration in registrations]))
+    )
+    users, credentials = list(), list()
+    for user_id, registration, _hashed in zip(user_ids, registrations,
+                                              hashes):
+        _user = new_user(registration.firstname, registration.lastname,
+                         registration.username, registration.email)
+        _user["UserID"] = user_id
+        users.append(_user)
+        credentials.append({
+            "UserID": user_id,
+            "Username": registration.username,
+            "credential": _hashed
+        })
+    return bulk_response(await db.bulk_create_users(users, credentials))
+
+
+@app.patch("/api/users/bulk", dependencies=[Depends(get_current_admin)])
+async def update_users_bulk(user_objects: List[models.UsersBulkPatch]):
+    check_bulk_size(user_objects)
+    logger.info(f"Bulk updating {len(user_objects)} users")
+    changes = list()
+    for user_object in user_objects:
+        _obj = user_object.dict(by_alias=True, exclude_unset=True)
+        changes.append((_obj.pop("UserID"), _obj))
+    return bulk_response(await db.bulk_update_users(changes))
+
+
+@app.delete("/api/users/bulk", dependencies=[Depends(get_current_admin)])
+async def delete_users_bulk(user_ids: List[str] = Body(...)):
+    check_bulk_size(user_ids)
+    logger.info(f"Bulk deleting {len(user_ids)} users")
+    return bulk_response(await db.bulk_delete_users(user_ids))
+
+
 @app.post("/api/user/verify", response_model=models.Credentials)
 # async def verify_user(form_data: OAuth2PasswordRequestForm = Depends()):
 async def verify_user(form_data: models.Credentials):
@@ -187,23 +404,29 @@ async def verify_user(form_data: models.Credentials):
 
 
 @app.get("/api/users/me", response_model=models.Users)
-async def get_user(user: models.Users = Depends(get_current_user)):
-    return user
-
-
-@app.post("/api/user/authenticate")
+async def get_user(
+        user: models.Users = Depends(get_current_user),
+        cond: ConditionalGet = Depends(conditional_get(private=True))):
+    # Every user write bumps Version, so it stands in for a body hash.
+    if user.get("Version") is None:
+        return cond.respond(db.shape("Users", user))
+    etag = f'"{user.get("UserID")}-{user.get("Version")}"'
+    return cond.respond_tagged(db.shape("Users", user), etag)
+
+
+@app.post("/api/user/authenticate",
+          dependencies=[Depends(admission("/api/user/authenticate"))])
 async def authenticate_user(form_data: models.LoginForm):
+    await enforce("/api/user/authenticate", username=form_data.username)
     _data = form_data.dict(by_alias=True)
-    user_object = await db.fetch_credential(_data.get("username"))
-    form_password = _data.get("password")
-    user_credential = user_object.get("credential")
-    is_valid = bcrypt.checkpw(form_password.encode(), user_credential.encode())
-    if is_valid:
+    user_object = await check_login(_data.get("username"),
+                                    _data.get("password"))
+    if user_object:
         _object = {
             "UserID": user_object.get("UserID"),
             # "Username": user_object.get("Username"),
         }
-        token = jwt.encode(_object, JWT_SECRET)
+        token = await encode_token(_object)
         return JSONResponse(status_code=200, content={
             "access_token": token,
             "token_type": "bearer"
@@ -219,7 +442,7 @@ async def get_user_by_id(user_id):
     logger.info(f"Getting user by ID: {user_id}")
     response = await db.fetch_user(user_id)
     if response:
-        return response
+        return FastJSONResponse(content=db.shape("Users", response))
     raise HTTPException(404, f"User with ID {user_id} not found here.")
 
 
@@ -228,7 +451,7 @@ async def get_user_by_id(user_email):
     logger.info(f"Getting user by Email: {user_email}")
     response = await db.fetch_user_by_email(user_email)
     if response:
-        return response
+        return FastJSONResponse(content=db.shape("Users", response))
     raise HTTPException(404, f"User with email {user_email} not found here.")
 
 
@@ -237,7 +460,7 @@ async def get_user_by_name(user_name):
     logger.info(f"Getting user by UserName: {user_name}")
     response = await db.fetch_user(user_name, by_id=False)
     if response:
-        return response
+        return FastJSONResponse(content=db.shape("Users", response))
     raise HTTPException(404, f"User with ID {user_name} not found here.")
 
 
@@ -247,13 +470,69 @@ async def update_user_by_id(user_object: models.Users):
     _obj = user_object.dict(by_alias=True)
     user_id = _obj.get("UserID")
     logger.info(f"Updating user by ID: {user_id}")
-    in_cart = _obj.get("InCart")
-    if in_cart:
-        _obj["InCart"] = list(set(_obj["InCart"]))
-    response = await db.fetch_user(user_id)
-    if response:
-        _updated = await db.update_user({"UserID": user_id}, _obj)
+    # A null cart is stored as an empty one.
+    _obj["InCart"] = list(dict.fromkeys(_obj.get("InCart") or []))
+    version = _obj.pop("Version", None)
+    try:
+        _updated = await db.update_user({"UserID": user_id}, _obj, version)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("User", e))
+    if _updated:
         return _updated
+    if version is not None and await db.fetch_user(user_id):
+        raise version_conflict(f"User with ID {user_id}")
+    raise HTTPException(404, f"User with ID {user_id} not found here.")
+
+
+@app.patch("/api/user/id/{user_id}", response_model=models.Users)
+async def patch_user_by_id(user_id, user_object: models.UsersPatch):
+    _obj = user_object.dict(by_alias=True, exclude_unset=True)
+    logger.info(f"Patching user by ID: {user_id}: {list(_obj)}")
+    version = _obj.pop("Version", None)
+    try:
+        _updated = await db.update_user({"UserID": user_id}, _obj, version)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("User", e))
+    if _updated:
+        return _updated
+    if version is not None and await db.fetch_user(user_id):
+        raise version_conflict(f"User with ID {user_id}")
+    raise HTTPException(404, f"User with ID {user_id} not found here.")
+
+
+@app.get("/api/user/id/{user_id}/cart")
+async def get_cart(user_id):
+    response = await db.fetch_cart(user_id)
+    if response:
+        return response
+    raise HTTPException(404, f"User with ID {user_id} not found here.")
+
+
+@app.post("/api/user/id/{user_id}/cart")
+async def add_to_cart(user_id, items: models.CartItems):
+    logger.info(f"Adding {len(items.EventIDs)} events to cart of {user_id}")
+    event_ids = list(dict.fromkeys(items.EventIDs))
+    response = await db.add_to_cart(user_id, event_ids)
+    if response:
+        return response
+    raise HTTPException(404, f"User with ID {user_id} not found here.")
+
+
+@app.delete("/api/user/id/{user_id}/cart/{event_id}")
+async def remove_from_cart(user_id, event_id):
+    logger.info(f"Removing {event_id} from cart of {user_id}")
+    response = await db.remove_from_cart(user_id, event_id)
+    if response:
+        return response
+    raise HTTPException(404, f"User with ID {user_id} not found here.")
+
+
+@app.delete("/api/user/id/{user_id}/cart")
+async def clear_cart(user_id):
+    logger.info(f"Clearing cart of {user_id}")
+    response = await db.clear_cart(user_id)
+    if response:
+        return response
     raise HTTPException(404, f"User with ID {user_id} not found here.")
 
 
@@ -262,35 +541,35 @@ async def update_user_by_name(user_object: models.Users):
     _obj = user_object.dict(by_alias=True)
     user_name = _obj.get("Username")
     logger.info(f"Updating user by UserName: {user_name}")
-    response = await db.fetch_user(user_name, by_id=False)
-    if response:
-        _updated = await db.update_user({"Username": user_name}, user_object)
+    _obj["InCart"] = list(dict.fromkeys(_obj.get("InCart") or []))
+    version = _obj.pop("Version", None)
+    try:
+        _updated = await db.update_user({"Username": user_name}, _obj,
+                                        version)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("User", e))
+    if _updated:
         return _updated
+    if version is not None and await db.fetch_user(user_name, by_id=False):
+        raise version_conflict(f"User with username {user_name}")
     raise HTTPException(404, f"User with username {user_name} not found here.")
 
 
 @app.delete("/api/user/id/{user_id}", response_model=models.Users)
 async def delete_user_by_id(user_id):
     logger.info(f"Deleting user by ID: {user_id}")
-    response = await db.fetch_user(user_id)
+    response = await db.delete_user_with_credential({"UserID": user_id})
     if response:
-        q = {"UserID": user_id}
-        delete_response = await db.delete_user(q)
-        if delete_response:
-            remove_credential = await db.delete_credential(q)
-            if remove_credential:
-                return response
+        return response
     raise HTTPException(404, f"User with ID {user_id} not found here.")
 
 
 @app.delete("/api/user/name/{user_name}", response_model=models.Users)
 async def delete_user_by_name(user_name):
     logger.info(f"Deleting user by UserName: {user_name}")
-    response = await db.fetch_user(user_name, by_id=False)
+    response = await db.delete_user_with_credential({"Username": user_name})
     if response:
-        delete_response = await db.delete_user({"Username": user_name})
-        if delete_response:
-            return response
+        return response
     raise HTTPException(404, f"User with username {user_name} not found here.")
 
 
@@ -299,102 +578,270 @@ async def create_event(event_object: models.Events):
     # _event = json.loads(jsonable_encoder(event_object))
     logger.info("Creating event")
     _event = event_object.dict(by_alias=True)
-    events = await db.fetch_events()
-    event_id_key = "EventID"
-    new_event_id = generate_new_id(events, event_id_key, "Events")
-    event_id = _event.get(event_id_key)
-    if event_id is None:
-        _event[event_id_key] = new_event_id
+    _event["Version"] = 0
+    _event["TicketsSold"] = 0
+    # EventID and EventName are unique indexes; catalog reads may come
+    # from a secondary, so conflicts are detected by the insert itself.
+    if _event.get("EventID") is None:
+        _event["EventID"] = await db.generate_new_id("Events")
     else:
-        id_response = await db.fetch_event(event_id)
-        if id_response:
-            raise HTTPException(409,
-                                f"Conflict: Event with ID {event_id} "
-                                f"already exists! Try again")
-    event_name = _event.get("EventName")
-    name_response = await db.fetch_event(event_name, by_id=False)
-    if name_response:
-        raise HTTPException(409,
-                            f"Conflict: Event with event name {event_name} "
-                            f"already exists! Try again")
-
-    else:
-        create_response = await db.create_event(_event)
-        if create_response:
-            _created = await db.fetch_event(create_response.get(event_id_key))
-            if _created:
-                return create_response
-
-            error_message = {"error": "Couldn't create new event"}
-            return error_message
-
-    raise HTTPException(400, f"Bad request.")
-
-
-@app.post("/api/save_contact_us/", response_model=models.ContactUs)
+        await db.advance_sequence("Events", [_event["EventID"]])
+    try:
+        return await db.create_event(_event)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("Event", e))
+
+
+@app.post("/api/events/bulk", dependencies=[Depends(get_current_admin)])
+async def create_events_bulk(event_objects: List[models.Events]):
+    check_bulk_size(event_objects)
+    logger.info(f"Bulk creating {len(event_objects)} events")
+    events = [event_object.dict(by_alias=True)
+              for event_object in event_objects]
+    missing = [_event for _event in events if _event.get("EventID") is None]
+    await db.advance_sequence("Events", [
+        _event["EventID"] for _event in events
+        if _event.get("EventID") is not None])
+    new_ids = await db.generate_new_ids("Events", len(missing))
+    for _event, event_id in zip(missing, new_ids):
+        _event["EventID"] = event_id
+    for _event in events:
+        _event["Version"] = 0
+        _event["TicketsSold"] = 0
+    return bulk_response(await db.bulk_create_events(events))
+
+
+@app.patch("/api/events/bulk", dependencies=[Depends(get_current_admin)])
+async def update_events_bulk(event_objects: List[models.EventsBulkPatch]):
+    check_bulk_size(event_objects)
+    logger.info(f"Bulk updating {len(event_objects)} events")
+    changes = list()
+    for event_object in event_objects:
+        _event = event_object.dict(by_alias=True, exclude_unset=True)
+        changes.append((_event.pop("EventID"), _event))
+    return bulk_response(await db.bulk_update_events(changes))
+
+
+@app.delete("/api/events/bulk", dependencies=[Depends(get_current_admin)])
+async def delete_events_bulk(event_ids: List[str] = Body(...)):
+    check_bulk_size(event_ids)
+    logger.info(f"Bulk deleting {len(event_ids)} events")
+    return bulk_response(await db.bulk_delete_events(event_ids))
+
+
+@app.post("/api/contact_us/bulk", dependencies=[Depends(get_current_admin)])
+async def create_contact_forms_bulk(form_objects: List[models.ContactUs]):
+    check_bulk_size(form_objects)
+    logger.info(f"Bulk creating {len(form_objects)} contact forms")
+    forms = [form_object.dict(by_alias=True) for form_object in form_objects]
+    # FormIDs are always allocated here; see create_contact_form.
+    new_ids = await db.generate_new_ids("ContactUs", len(forms))
+    for _obj, form_id in zip(forms, new_ids):
+        _obj["FormID"] = form_id
+    return bulk_response(await db.bulk_create_contact_forms(forms))
+
+
+@app.delete("/api/contact_us/bulk", dependencies=[Depends(get_current_admin)])
+async def delete_contact_forms_bulk(form_ids: List[str] = Body(...)):
+    check_bulk_size(form_ids)
+    logger.info(f"Bulk deleting {len(form_ids)} contact forms")
+    return bulk_response(await db.bulk_delete_contact_forms(form_ids))
+
+
+@app.post("/api/save_contact_us/", response_model=models.ContactUs,
+          dependencies=[Depends(rate_limit("/api/save_contact_us/"))])
 async def create_contact_form(form_object: models.ContactUs):
     # _event = json.loads(jsonable_encoder(event_object))
     logger.info("Creating Contact Us")
     _obj = form_object.dict(by_alias=True)
-    forms = await db.fetch_contact_forms()
-    id_key = "FormID"
-    new_form_id = generate_new_id(forms, id_key, "ContactUs")
-    form_id = _obj.get(id_key)
-    if form_id is None:
-        _obj[id_key] = new_form_id
-    else:
-        id_response = await db.fetch_contact_form(form_id)
-        if id_response:
-            raise HTTPException(409,
-                                f"Conflict: Contact Form with ID {form_id} "
-                                f"already exists! Try again")
-
-    create_response = await db.create_contact_form(_obj)
-    logger.info(f"create_response: {create_response}")
-    if create_response:
-        _created = await db.fetch_contact_form(create_response.get(id_key))
-        if _created:
-            return create_response
-
-        error_message = {"error": "Couldn't create contact form"}
-        return error_message
-
-    raise HTTPException(400, f"Bad request.")
+    # A FormID sent by the client is ignored: IDs come from blocks other
+    # workers reserved earlier, which a chosen ID could collide with.
+    _obj["FormID"] = await form_ids.next()
+    if CONTACT_WRITE_BEHIND:
+        # Acknowledged once buffered.
+        try:
+            await contact_forms.submit(_obj)
+        except batching.BufferFull as e:
+            raise HTTPException(503, str(e), headers={"Retry-After": "1"})
+        return FastJSONResponse(status_code=202, content=_obj)
+    # FormID is a unique index, so the insert itself detects conflicts.
+    try:
+        return await db.create_contact_form(_obj)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("Contact Form", e))
 
 
 @app.get("/api/get_contact_us")
-async def get_contact_forms():
+async def get_contact_forms(
+        limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: str = None,
+        email: str = None):
     logger.info("Getting ContactUs forms")
-    response = await db.fetch_contact_forms()
+    query = build_query(Email=email)
+    if limit is not None or after is not None:
+        page = await fetch_page("ContactUs", limit, after, query)
+        return FastJSONResponse(status_code=200, content=page)
+    response = await db.fetch_contact_forms(query)
     if response:
-        return response
+        return FastJSONResponse(status_code=200, content=response)
     raise HTTPException(404, f"Contact Us forms not found here: {response}")
 
 
+async def cached_body(key, load):
+    # Serialized catalog response and its ETag, kept in the event cache
+    # next to the documents so the same writes drop both. Returns None
+    # when `load` finds nothing.
+    key = ("body",) + key
+    rendered = db.event_cache.get(key)
+    if rendered is not None:
+        return rendered
+    version = db.event_cache.version(key)
+    content = await load()
+    if not content:
+        return None
+    rendered = render(content)
+    if db.event_cache.version(key) == version:
+        db.event_cache.set(key, rendered)
+    return rendered
+
+
 @app.get("/api/events")
-async def get_events():
+async def get_events(
+        limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: str = None,
+        event_type: str = None,
+        genre_id: str = None,
+        venue: str = None,
+        is_hero: bool = None,
+        cond: ConditionalGet = Depends(conditional_get(CATALOG_MAX_AGE))):
     # logger.info("Getting Events")
-    response = await db.fetch_events()
+    query = build_query(EventType=event_type, GenreID=genre_id,
+                        Venue=venue, IsHero=is_hero)
+    if limit is not None or after is not None:
+        return cond.respond(await fetch_page("Events", limit, after, query))
+    if not query:
+        rendered = await cached_body(("all",), db.fetch_events)
+        if rendered:
+            return cond.respond_body(*rendered)
+        raise HTTPException(404, "Events not found here: []")
+    response = await db.fetch_events(query)
     if response:
-        return response
+        return cond.respond(response)
     raise HTTPException(404, f"Events not found here: {response}")
 
 
+def parse_date(value, end=False):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(400, f"Bad request: {value} is not an ISO "
+                                 f"date.")
+    # A date-only upper bound takes in the whole day.
+    if end and len(value) == 10:
+        return {"$lt": parsed + timedelta(days=1)}
+    return {"$lte" if end else "$gte": parsed}
+
+
+def date_range(date_from, date_to):
+    # EventDate is stored as an ISO string or as a BSON date, and range
+    # operators only compare values of one type, so both are matched:
+    # strings against the bounds as given, dates against them parsed.
+    strings = build_query(**{"$gte": date_from, "$lte": date_to})
+    if not strings:
+        return None
+    dates = dict()
+    if date_from:
+        dates.update(parse_date(date_from))
+    if date_to:
+        dates.update(parse_date(date_to, end=True))
+    return [{"EventDate": strings}, {"EventDate": dates}]
+
+
+@app.get("/api/events/search")
+async def search_events(
+        q: str = None,
+        genre_id: str = None,
+        genre: str = None,
+        event_type: str = None,
+        venue: str = None,
+        artist: str = None,
+        is_hero: bool = None,
+        date_from: str = None,
+        date_to: str = None,
+        sort: str = "date",
+        limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: str = None,
+        cond: ConditionalGet = Depends(conditional_get(CATALOG_MAX_AGE))):
+    if sort not in db.EVENT_SORTS:
+        raise HTTPException(400, f"Bad request: sort must be one of "
+                                 f"{', '.join(db.EVENT_SORTS)}.")
+    query = build_query(GenreID=genre_id, Genres=genre, EventType=event_type,
+                        Venue=venue, Artists=artist, IsHero=is_hero)
+    dates = date_range(date_from, date_to)
+    if dates:
+        query["$or"] = dates
+    if q:
+        query["$text"] = {"$search": q}
+    logger.info(f"Searching events: {list(query)} sorted by {sort}")
+    try:
+        page = await db.search_events(query, sort, limit or DEFAULT_PAGE_SIZE,
+                                      after)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return cond.respond(page)
+
+
+@app.get("/api/feed")
+async def get_feed(
+        cond: ConditionalGet = Depends(conditional_get(CATALOG_MAX_AGE))):
+    body, etag = await feed.current()
+    return cond.respond_body(body, etag)
+
+
+@app.get("/api/events/live")
+async def stream_changes(last_event_id: str = Header(None)):
+    # EventSource sends Last-Event-ID by itself when it reconnects.
+    if not live.available:
+        raise HTTPException(503, "Live updates are unavailable right now.")
+    queue, backlog = live.subscribe(last_event_id)
+    return StreamingResponse(live.stream(queue, backlog),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return db.cache_stats()
+
+
 @app.get("/api/event/id/{event_id}", response_model=models.Events)
-async def get_event_by_id(event_id):
+async def get_event_by_id(
+        event_id,
+        cond: ConditionalGet = Depends(conditional_get(CATALOG_MAX_AGE))):
     logger.info(f"Getting Event by ID: {event_id}")
-    response = await db.fetch_event(event_id)
-    if response:
-        return response
+
+    async def load():
+        response = await db.fetch_event(event_id)
+        return response and db.shape("Events", response)
+    rendered = await cached_body(("id", event_id), load)
+    if rendered:
+        return cond.respond_body(*rendered)
     raise HTTPException(404, f"Event with ID {event_id} not found here.")
 
 
 @app.get("/api/event/name/{event_name}", response_model=models.Events)
-async def get_event_by_name(event_name):
+async def get_event_by_name(
+        event_name,
+        cond: ConditionalGet = Depends(conditional_get(CATALOG_MAX_AGE))):
     logger.info(f"Getting Events by name: {event_name}")
-    response = await db.fetch_event(event_name, by_id=False)
-    if response:
-        return response
+
+    async def load():
+        response = await db.fetch_event(event_name, by_id=False)
+        return response and db.shape("Events", response)
+    rendered = await cached_body(("name", event_name), load)
+    if rendered:
+        return cond.respond_body(*rendered)
     raise HTTPException(404, f"Event with name {event_name} not found here.")
 
 
@@ -403,50 +850,155 @@ async def update_event_by_id(event_object: models.Events):
     # _obj = json.loads(jsonable_encoder(new_object))
     logger.info("Updating event")
     _event = event_object.dict(by_alias=True)
-    logger.info(_event)
+    logger.info(logs.summarize(_event))
     event_id_key = "EventID"
     event_id = _event.get(event_id_key)
-    response = await db.fetch_event(event_id)
-    if response:
-        _updated = await db.update_event({event_id_key: event_id}, _event)
+    version = _event.pop("Version", None)
+    try:
+        _updated = await db.update_event({event_id_key: event_id}, _event,
+                                         version)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("Event", e))
+    if _updated:
+        return _updated
+    if version is not None and await db.fetch_event(event_id):
+        raise version_conflict(f"Event with ID {event_id}")
+    raise HTTPException(404, f"Event with ID {event_id} not found here.")
+
+
+@app.patch("/api/event/id/{event_id}", response_model=models.Events)
+async def patch_event_by_id(event_id, event_object: models.EventsPatch):
+    _event = event_object.dict(by_alias=True, exclude_unset=True)
+    logger.info(f"Patching event by ID: {event_id}: {list(_event)}")
+    version = _event.pop("Version", None)
+    try:
+        _updated = await db.update_event({"EventID": event_id}, _event,
+                                         version)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("Event", e))
+    if _updated:
         return _updated
+    if version is not None and await db.fetch_event(event_id):
+        raise version_conflict(f"Event with ID {event_id}")
     raise HTTPException(404, f"Event with ID {event_id} not found here.")
 
 
 @app.put("/api/event/name/{event_name}", response_model=models.Events)
-async def update_event_by_name(event_name, new_object):
-    response = await db.fetch_event(event_name, by_id=False)
-    if response:
-        _updated = await db.update_event({"EventName": event_name}, new_object)
+async def update_event_by_name(event_name, event_object: models.EventsPatch):
+    _event = event_object.dict(by_alias=True, exclude_unset=True)
+    logger.info(f"Updating event by name: {event_name}: {list(_event)}")
+    version = _event.pop("Version", None)
+    try:
+        _updated = await db.update_event({"EventName": event_name}, _event,
+                                         version)
+    except DuplicateKeyError as e:
+        raise HTTPException(409, conflict_message("Event", e))
+    if _updated:
         return _updated
+    if version is not None and await db.fetch_event(event_name,
+                                                    by_id=False):
+        raise version_conflict(f"Event with name {event_name}")
     raise HTTPException(404, f"Event with name {event_name} not found here.")
 
 
 @app.delete("/api/event/id/{event_id}", response_model=models.Events)
 async def delete_event_by_id(event_id):
     logger.info(f"Deleting Event by ID: {event_id}")
-    response = await db.fetch_event(event_id)
+    response = await db.delete_event({"EventID": event_id})
     if response:
-        delete_response = await db.delete_event({"EventID": event_id})
-        if delete_response:
-            return response
+        return response
     raise HTTPException(404, f"Event with ID {event_id} not found here.")
 
 
 @app.delete("/api/event/name/{event_name}", response_model=models.Events)
 async def delete_event_by_name(event_name):
-    response = await db.fetch_event(event_name, by_id=False)
+    response = await db.delete_event({"EventName": event_name})
     if response:
-        delete_response = await db.delete_event({"EventName": event_name})
-        if delete_response:
-            return response
+        return response
     raise HTTPException(404, f"Event with name {event_name} not found here.")
 
 
+@app.post("/api/event/id/{event_id}/purchase")
+async def purchase_tickets(event_id, purchase: models.TicketPurchase,
+                           current_user=Depends(get_current_principal)):
+    # Only the caller's UserID is needed; purchase_tickets itself fails
+    # with LookupError if that user no longer exists.
+    quantity = purchase.Quantity
+    if not 1 <= quantity <= MAX_TICKETS_PER_ORDER:
+        raise HTTPException(400, f"Bad request: between 1 and "
+                                 f"{MAX_TICKETS_PER_ORDER} tickets per order.")
+    user_id = current_user.get("UserID")
+    logger.info(f"User {user_id} buying {quantity} tickets for {event_id}")
+    try:
+        purchase = await db.purchase_tickets(event_id, user_id, quantity,
+                                             purchase.PaymentMethod)
+    except LookupError:
+        raise HTTPException(404, f"User with ID {user_id} not found here.")
+    if purchase:
+        event, tickets = purchase
+        remaining = None
+        if event.get("Capacity") is not None:
+            remaining = event["Capacity"] - event["TicketsSold"]
+        return {"EventID": event_id, "Tickets": tickets,
+                "TicketsRemaining": remaining}
+    if await db.fetch_event(event_id):
+        raise HTTPException(409, f"Event with ID {event_id} has fewer than "
+                                 f"{quantity} tickets left.")
+    raise HTTPException(404, f"Event with ID {event_id} not found here.")
+
+
+REPORT_SORTS = {
+    "tickets": [("Tickets", -1), ("Key", 1)],
+    "revenue": [("Revenue", -1), ("Key", 1)],
+}
+
+
+def report_sort(sort):
+    if sort not in REPORT_SORTS:
+        raise HTTPException(400, f"Bad request: sort must be one of "
+                                 f"{', '.join(REPORT_SORTS)}.")
+    return REPORT_SORTS[sort]
+
+
+@app.get("/api/reports/events", dependencies=[Depends(get_current_admin)])
+async def get_event_sales(
+        sort: str = "tickets",
+        genre_id: str = None,
+        limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE)):
+    query = build_query(GenreID=genre_id)
+    return await db.fetch_rollups("event", query, report_sort(sort), limit)
+
+
+@app.get("/api/reports/genres", dependencies=[Depends(get_current_admin)])
+async def get_genre_sales(sort: str = "revenue"):
+    return await db.fetch_rollups("genre", sort=report_sort(sort))
+
+
+@app.get("/api/reports/daily", dependencies=[Depends(get_current_admin)])
+async def get_daily_sales(date_from: str = None, date_to: str = None):
+    days = build_query(**{"$gte": date_from, "$lte": date_to})
+    query = {"Key": days} if days else None
+    return await db.fetch_rollups("day", query)
+
+
+@app.post("/api/reports/rebuild", dependencies=[Depends(get_current_admin)])
+async def rebuild_reports():
+    logger.info("Rebuilding sales rollups")
+    return {"rollups": await db.rebuild_rollups()}
+
+
 @app.get("/api/tickets")
-async def get_tickets():
+async def get_tickets(
+        limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: str = None,
+        event_id: str = None,
+        user_id: str = None):
     logger.info("Getting Tickets")
-    response = await db.fetch_tickets()
+    query = build_query(EventID=event_id, UserID=user_id)
+    if limit is not None or after is not None:
+        page = await fetch_page("Tickets", limit, after, query)
+        return FastJSONResponse(status_code=200, content=page)
+    response = await db.fetch_tickets(query)
     if response:
-        return response
+        return FastJSONResponse(status_code=200, content=response)
     raise HTTPException(404, f"Tickets not found here.")
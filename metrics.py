@@ -0,0 +1,202 @@
+import bisect
+import threading
+import time
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = list()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace(
+        "\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    text = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + text + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = dict()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        # inc() runs on executor and driver threads too, so the values are
+        # copied under the lock before rendering.
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} "
+                         f"{value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class CallbackGauge(Gauge):
+    # Reads its values at scrape time from `function`, which returns
+    # {label values tuple: value}.
+
+    def __init__(self, name, documentation, labels, function):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def render(self):
+        values = dict(self.function())
+        with self._lock:
+            self._values = values
+        return super().render()
+
+
+class CallbackCounter(CallbackGauge):
+    kind = "counter"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets),
+                                                0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count)
+                            in self._values.items())
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labels, labels, [("le", bound)])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labels, labels, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{le} {count}")
+            tags = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{tags} {total}")
+            lines.append(f"{self.name}_count{tags} {count}")
+        return lines
+
+
+def render():
+    lines = list()
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter("http_requests_total",
+                        "HTTP requests handled.",
+                        ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds",
+                         "HTTP request latency.", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight",
+                       "HTTP requests currently being handled.")
+bcrypt_latency = Histogram("bcrypt_duration_seconds",
+                           "Time spent in bcrypt per call.", ("operation",))
+mongo_latency = Histogram("mongodb_command_duration_seconds",
+                          "MongoDB command latency.",
+                          ("collection", "command"))
+mongo_failures = Counter("mongodb_command_failures_total",
+                         "MongoDB commands that failed.",
+                         ("collection", "command"))
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.dec()
+            # Label by route template, never by raw path, to keep the
+            # number of series bounded.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(scope["method"], route, str(status[0]))
+            http_latency.observe(elapsed, scope["method"], route)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = dict()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        self._collections[event.request_id] = \
+            target if isinstance(target, str) else "-"
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "-")
+        mongo_latency.observe(event.duration_micros / 1e6, collection,
+                              event.command_name)
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, "-")
+        mongo_latency.observe(event.duration_micros / 1e6, collection,
+                              event.command_name)
+        mongo_failures.inc(collection, event.command_name)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Any
+from pydantic import BaseModel, Field, validator
+from typing import Any, List, Optional
 
 
 class Users(BaseModel):
@@ -15,11 +15,39 @@ class Users(BaseModel):
     IsAdmin: Any
     MyGenres: Any
     InCart: Any
+    Version: Optional[int] = None
 
     class Config:
         allow_population_by_field_name = True
 
 
+class UsersPatch(BaseModel):
+    Username: Any = None
+    FirstName: Any = None
+    LastName: Any = None
+    Email: Any = None
+    PaymentType: Any = None
+    MyEvents: Any = None
+    MyGenres: Any = None
+    InCart: Any = None
+    Version: Optional[int] = None
+
+    @validator("InCart")
+    def cart_not_null(cls, value):
+        # Omit InCart to leave it alone; the cart routes expect a list.
+        if value is None:
+            raise ValueError("InCart may not be null")
+        return value
+
+
+class UsersBulkPatch(UsersPatch):
+    UserID: str
+
+
+class CartItems(BaseModel):
+    EventIDs: List[str]
+
+
 class Events(BaseModel):
     EventID: Any
     EventName: Any
@@ -38,6 +66,34 @@ class Events(BaseModel):
     HostName: Any
     specialNote: Any
     headlineArtist: Any
+    Capacity: Optional[int] = None
+    TicketsSold: Optional[int] = None
+    Version: Optional[int] = None
+
+
+class EventsPatch(BaseModel):
+    EventName: Any = None
+    EventDescription: Any = None
+    Venue: Any = None
+    Artists: Any = None
+    EventDate: Any = None
+    EventTime: Any = None
+    EventEndTime: Any = None
+    EventType: Any = None
+    Price: Any = None
+    GenreID: Any = None
+    Image: Any = None
+    Genres: Any = None
+    IsHero: Any = None
+    HostName: Any = None
+    specialNote: Any = None
+    headlineArtist: Any = None
+    Capacity: Optional[int] = None
+    Version: Optional[int] = None
+
+
+class EventsBulkPatch(EventsPatch):
+    EventID: str
 
 
 class Tickets(BaseModel):
@@ -46,6 +102,12 @@ class Tickets(BaseModel):
     UserID: Any
     PaymentMethod: Any
     PurchaseDate: Any
+    Price: Any
+
+
+class TicketPurchase(BaseModel):
+    Quantity: int = 1
+    PaymentMethod: Any = None
 
 
 class Credentials(BaseModel):
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+from constants import BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_MAX_PENDING
+import metrics
+import logging
+
+logger = logging.getLogger("controller")
+
+# bcrypt releases the GIL while hashing, so a small thread pool keeps the
+# event loop free without the cost of a process pool.
+_executor = None
+_pending = 0
+
+
+class PoolBusy(Exception):
+    pass
+
+
+metrics.CallbackGauge("bcrypt_pending", "Password operations queued or "
+                      "running.", (), lambda: {(): _pending})
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS,
+                                       thread_name_prefix="bcrypt")
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _reset_after_fork():
+    # Pool threads do not survive fork(); the child builds its own pool.
+    global _executor, _pending
+    _executor = None
+    _pending = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def _run(function, *args):
+    global _pending
+    if _pending >= BCRYPT_MAX_PENDING:
+        logger.warning(f"Password pool busy: {_pending} pending")
+        raise PoolBusy("Too many password operations in progress")
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), _timed, function,
+                                          *args)
+    finally:
+        _pending -= 1
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        metrics.bcrypt_latency.observe(time.perf_counter() - start,
+                                       function.__name__.strip("_"))
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+def cost(hashed):
+    # "$2b$12$<salt+hash>" -> 12
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    return cost(hashed) != BCRYPT_ROUNDS
+
+
+async def hash_password(password):
+    return await _run(_hash, password, BCRYPT_ROUNDS)
+
+
+async def verify_password(password, hashed):
+    return await _run(_check, password, hashed)
+
+
+async def hash_many(passwords):
+    # Hashes in rounds of BCRYPT_WORKERS so a large batch never fills the
+    # pending queue that interactive logins rely on.
+    hashed = list()
+    for start in range(0, len(passwords), BCRYPT_WORKERS):
+        batch = passwords[start:start + BCRYPT_WORKERS]
+        hashed.extend(await asyncio.gather(
+            *[hash_password(password) for password in batch]))
+    return hashed
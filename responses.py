@@ -0,0 +1,19 @@
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    # Serializes with orjson when it is installed. Types orjson does not
+    # know (ObjectId, Decimal128, ...) go through jsonable_encoder, so
+    # content does not need a jsonable_encoder pass up front.
+
+    def render(self, content):
+        if orjson is None:
+            return super().render(jsonable_encoder(content))
+        return orjson.dumps(content, default=jsonable_encoder,
+                            option=orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,14 @@
+import uvicorn
+from constants import HOST, PORT, WEB_CONCURRENCY, GRACEFUL_TIMEOUT
+from constants import FORWARDED_ALLOW_IPS
+
+# Production entry point. uvicorn starts WEB_CONCURRENCY worker processes,
+# each importing main:app on its own, and every worker creates its Motor
+# client, log writers and bcrypt pool in the startup hook. Modules that
+# hold such state also reset it after a fork, so a preloading process
+# manager is safe as well. X-Forwarded-For is only honoured from
+# FORWARDED_ALLOW_IPS; see also TRUSTED_PROXY_HOPS.
+if __name__ == "__main__":
+    uvicorn.run("main:app", host=HOST, port=PORT, workers=WEB_CONCURRENCY,
+                timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+                proxy_headers=True, forwarded_allow_ips=FORWARDED_ALLOW_IPS)
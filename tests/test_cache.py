@@ -0,0 +1,38 @@
+from cache import TTLCache
+
+
+def test_delete_of_another_key_does_not_block_a_fill():
+    cache = TTLCache(10, 60)
+    cache.set("k1", "old")
+    version = cache.version("k2")
+    cache.delete("k1")
+    assert cache.version("k2") == version
+    cache.set("k2", "loaded")
+    assert cache.get("k2") == "loaded"
+    assert cache.get("k1") is None
+
+
+def test_delete_of_the_same_key_invalidates_a_fill():
+    cache = TTLCache(10, 60)
+    version = cache.version("k1")
+    cache.delete("k1")
+    assert cache.version("k1") != version
+
+
+def test_clear_and_delete_where_invalidate_every_key():
+    cache = TTLCache(10, 60)
+    version = cache.version("k2")
+    cache.clear()
+    assert cache.version("k2") != version
+    version = cache.version(("user", "token"))
+    cache.delete_where(lambda key: key[0] == "user")
+    assert cache.version(("user", "token")) != version
+
+
+def test_forgotten_delete_counts_still_change_versions():
+    cache = TTLCache(2, 60)
+    version = cache.version("k1")
+    cache.delete("k1")
+    cache.delete("k2")
+    cache.delete("k3")
+    assert cache.version("k1") != version
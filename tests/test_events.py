@@ -0,0 +1,53 @@
+import asyncio
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+import database as db
+import main
+import models
+
+
+def event(**fields):
+    return {**dict.fromkeys(models.Events.__fields__), **fields}
+
+
+def request(method, path, documents=(), **kwargs):
+    async def run():
+        await db.connect(AsyncMongoMockClient(), "couchtest")
+        try:
+            if documents:
+                await db.database.Events.insert_many(list(documents))
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport,
+                                         base_url="http://test") as client:
+                response = await client.request(method, path, **kwargs)
+            return response, await db.database.Events.find_one({}, {"_id": 0})
+        finally:
+            db.close()
+            db.event_cache.clear()
+    return asyncio.run(run())
+
+
+def test_update_event_by_name_takes_a_json_body():
+    response, stored = request(
+        "PUT", "/api/event/name/Show",
+        [event(EventID="A1", EventName="Show", Venue="Hall", Version=0)],
+        json={"Venue": "Arena"})
+    assert response.status_code == 200
+    assert response.json()["Venue"] == "Arena"
+    assert stored["Venue"] == "Arena"
+    assert stored["Version"] == 1
+
+
+def test_update_event_by_name_checks_the_version():
+    response, stored = request(
+        "PUT", "/api/event/name/Show",
+        [event(EventID="A1", EventName="Show", Venue="Hall", Version=3)],
+        json={"Venue": "Arena", "Version": 2})
+    assert response.status_code == 409
+    assert stored["Venue"] == "Hall"
+
+
+def test_update_event_by_name_not_found():
+    response, _ = request("PUT", "/api/event/name/Nope",
+                          json={"Venue": "Arena"})
+    assert response.status_code == 404
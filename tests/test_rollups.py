@@ -0,0 +1,33 @@
+import asyncio
+from types import SimpleNamespace
+from bson import Decimal128
+import database as db
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.operations = list()
+
+    async def bulk_write(self, operations, ordered=True):
+        self.operations.extend(operations)
+
+
+def test_price_accepts_decimal128():
+    assert db._price(Decimal128("12.50")) == 12.5
+    assert db._price("7") == 7.0
+    assert db._price(None) == 0.0
+
+
+def test_record_sale_counts_decimal128_revenue(monkeypatch):
+    rollups = RecordingCollection()
+    monkeypatch.setattr(db, "database", SimpleNamespace(SalesRollups=rollups))
+    event = {"EventID": "A1", "EventName": "Show", "GenreID": "G1",
+             "EventDate": "2026-10-18", "Price": Decimal128("12.50")}
+    asyncio.run(db.record_sale(event, 2, "2026-10-18T10:00:00+00:00"))
+    increments = {operation._filter["_id"]: operation._doc["$inc"]
+                  for operation in rollups.operations}
+    assert increments == {
+        "event|A1": {"Tickets": 2, "Revenue": 25.0},
+        "genre|G1": {"Tickets": 2, "Revenue": 25.0},
+        "day|2026-10-18": {"Tickets": 2, "Revenue": 25.0},
+    }